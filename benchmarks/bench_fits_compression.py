@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+from astropy.io import fits
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from constants import *
+from packet_table import FilePackets
+import fits_writer
+
+# Benchmark of the FITS output modes of read_bin.compile_data (fits_writer.write_fits):
+# write throughput, file size and read-back speed of an uncompressed image against tile-compressed ones.
+# usage: python benchmarks/bench_fits_compression.py [repeat]
+
+MODES = [(None, None), ('RICE_1', (16, 3008)), ('RICE_1', (1, 3008)), ('RICE_1', (256, 256)),
+         ('GZIP_1', (16, 3008)), ('GZIP_2', (16, 3008))]
+
+def make_image(seed=0):
+    '''
+    A synthetic sky image: background with a gradient, read noise and a few hundred stars.
+    '''
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:fits_writer.IMAGE_SHAPE[0], 0:fits_writer.IMAGE_SHAPE[1]]
+    image = 1000 + 0.05*x + 0.03*y + rng.normal(0, 10, fits_writer.IMAGE_SHAPE)
+    for sy, sx, flux in zip(rng.integers(0, 3003, 300), rng.integers(0, 3008, 300), rng.uniform(1e3, 5e4, 300)):
+        y0, y1, x0, x1 = max(sy-8, 0), sy+9, max(sx-8, 0), sx+9
+        image[y0:y1, x0:x1] += flux*np.exp(-((y[y0:y1, x0:x1]-sy)**2 + (x[y0:y1, x0:x1]-sx)**2)/(2*1.5**2))
+    return np.clip(image, 0, 65535).astype(np.uint16)
+
+def make_file(image):
+    Length = image.nbytes
+    This_file = FilePackets(20240101000000, 0, Length)
+    buf = np.zeros(This_file.n_packets*MAX_DATA_SIZE, dtype=np.uint8)
+    buf[:Length] = image.view(np.uint8).ravel()
+    This_file.insert_many(np.arange(1, This_file.n_packets+1), buf.reshape(-1, MAX_DATA_SIZE))
+    return This_file
+
+def read_back(file_path):
+    with fits.open(file_path) as hdul:
+        hdu = hdul[1] if len(hdul) > 1 else hdul[0]
+        return np.array(hdu.data)
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    image = make_image()
+    This_file = make_file(image)
+    print(f'{"mode":>8} {"tile":>11} {"size [MB]":>10} {"ratio":>6} {"write [MB/s]":>13} {"read [MB/s]":>12}')
+    with tempfile.TemporaryDirectory() as folder:
+        for compression, tile_shape in MODES:
+            file_path = os.path.join(folder, 'image.fits')
+            t_write, t_read = [], []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                fits_writer.write_fits(This_file, file_path, compression=compression, tile_shape=tile_shape)
+                t_write.append(time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                data = read_back(file_path)
+                t_read.append(time.perf_counter() - t0)
+            assert np.array_equal(data, image), f'{compression} is not lossless'
+            size = os.path.getsize(file_path)
+            mb = image.nbytes/1e6
+            tile = 'x'.join(map(str, tile_shape)) if tile_shape else '-'
+            print(f'{str(compression):>8} {tile:>11} {size/1e6:10.2f} {image.nbytes/size:6.2f} '
+                  f'{mb/min(t_write):13.1f} {mb/min(t_read):12.1f}')
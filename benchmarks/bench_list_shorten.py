@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import cmd_gen
+
+# Benchmark of cmd_gen.list_shorten against the previous implementation,
+# which recomputed every gap and rebuilt the list for each merge (O(n^2)).
+# usage: python benchmarks/bench_list_shorten.py [N_id]
+
+def list_shorten_reference(lists,N_id):
+    while (len(lists)>N_id):
+        length_lists = np.array([lists[i+1][2]-lists[i][3] for i in range(len(lists)-1)])
+        length_min = np.min(length_lists)
+        i_merge = np.where(length_lists == length_min)[0][0]
+        list_add = [lists[i_merge][0],lists[i_merge][1],lists[i_merge][2],lists[i_merge+1][3],lists[i_merge][4]]
+        lists = lists[:i_merge] + [list_add] + lists[i_merge+2:]
+    return lists
+
+def make_segments(n_segments, seed=0):
+    '''
+    Missing segments of a heavily fragmented file: n_segments ranges with random lengths and gaps
+    (small gaps, so that ties between equal gaps are frequent).
+    '''
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(0, 4, n_segments)
+    gaps = rng.integers(2, 8, n_segments)
+    starts = np.cumsum(gaps + np.concatenate(([0], lengths[:-1])))
+    ends = starts + lengths
+    return [[1700000000, 'Missing', int(s), int(e), 50.0] for s, e in zip(starts, ends)]
+
+def timeit(func, lists, N_id):
+    t0 = time.perf_counter()
+    out = func(list(lists), N_id)
+    return out, time.perf_counter() - t0
+
+if __name__ == "__main__":
+    N_id = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f'{"segments":>10} {"list_shorten [s]":>18} {"reference [s]":>15}')
+    for n_segments in [100, 1000, 5000, 10000, 100000]:
+        lists = make_segments(n_segments)
+        out, t_new = timeit(cmd_gen.list_shorten, lists, N_id)
+        if n_segments <= 5000:
+            ref, t_ref = timeit(list_shorten_reference, lists, N_id)
+            assert out == ref, f'result differs from the reference for {n_segments} segments'
+            ref_str = f'{t_ref:15.4f}'
+        else:
+            ref_str = f'{"(skipped)":>15}'
+        print(f'{n_segments:>10} {t_new:18.4f} {ref_str}')
@@ -0,0 +1,157 @@
+import os
+import sys
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from constants import *
+from frames import VCDU_OFFSET, SEQ_OFFSET, MDPU_OFFSET, PAYLOAD_OFFSET
+from integrity import crc16_frames
+from packet_table import packet_count
+
+# Synthetic X-band captures in the format of the optical receiver:
+#   SYNC_MARKER + [Optical Extra Header (28)] + [VCDU header (2) + sequence (3) + reserved (1) + MDPU header (22)] +
+#   [payload (MAX_DATA_SIZE)] + [Optical Extra Trailer (160)]
+# with configurable loss (random or in bursts), duplicated frames and corrupted frames.
+# usage: python benchmarks/capture_gen.py output.bin [--files 4 --type 0 --loss 0.01 ...]
+
+IMAGE_LENGTH = 3003*3008*2 # bytes of a FITS mission image
+CALLSIGN = b'JG6YBW\x00'
+
+def file_content(Length, Type, rng):
+    '''
+    The content of a synthetic file: a noisy sky image for FITS, random text-like bytes otherwise.
+    '''
+    if Type == 0 and Length == IMAGE_LENGTH:
+        image = 1000 + rng.normal(0, 10, (3003, 3008))
+        return np.clip(image, 0, 65535).astype(np.uint16).view(np.uint8).reshape(-1)
+    return rng.integers(32, 127, Length, dtype=np.uint8)
+
+def make_frames(unix_time, Type, Length, content, psc):
+    '''
+    Build the frames of the packets psc of one file.
+    Output:
+        frames: ndarray (len(psc), len(SYNC_MARKER) + FRAME_SIZE) uint8
+    '''
+    n = len(psc)
+    frames = np.zeros((n, len(SYNC_MARKER) + FRAME_SIZE), dtype=np.uint8)
+    frames[:, :len(SYNC_MARKER)] = np.frombuffer(SYNC_MARKER, dtype=np.uint8)
+    body = frames[:, len(SYNC_MARKER):]
+    body[:, :OPT_EXTRA_HEADER] = 0xAA
+    body[:, VCDU_OFFSET:VCDU_OFFSET+2] = np.frombuffer(VCDU_head, dtype=np.uint8)
+    body[:, SEQ_OFFSET:SEQ_OFFSET+3] = psc.astype('>u4').view(np.uint8).reshape(-1, 4)[:, 1:]
+    mdpu = body[:, MDPU_OFFSET:MDPU_OFFSET+22]
+    mdpu[:, 0:2] = [0x00, 0x01]
+    mdpu[:, 2:9] = np.frombuffer(CALLSIGN, dtype=np.uint8)
+    mdpu[:, 9:13] = np.frombuffer(int(unix_time).to_bytes(4, 'big'), dtype=np.uint8)
+    mdpu[:, 17:21] = np.frombuffer(int(Length).to_bytes(4, 'big'), dtype=np.uint8)
+    mdpu[:, 21] = Type
+    padded = np.zeros(packet_count(Length)*MAX_DATA_SIZE, dtype=np.uint8)
+    padded[:Length] = content
+    body[:, PAYLOAD_OFFSET:PAYLOAD_OFFSET+MAX_DATA_SIZE] = padded.reshape(-1, MAX_DATA_SIZE)[psc-1]
+    body[:, PAYLOAD_OFFSET+MAX_DATA_SIZE:] = 0xBB
+    return frames
+
+def lost_packets(n_packets, loss, burst, rng):
+    '''
+    The packets lost in a pass: a fraction `loss` of the packets, in bursts of `burst` consecutive packets.
+    '''
+    lost = np.zeros(n_packets, dtype=bool)
+    n_bursts = int(round(n_packets*loss/max(burst, 1)))
+    for start in rng.integers(0, n_packets, n_bursts):
+        lost[start:start+burst] = True
+    return lost
+
+def generate_capture(n_files=4, Type=0, Length=None, loss=0.0, burst=1, dup=0.0, corrupt=0.0,
+                     corrupt_header=0.0, crc=None, start_time=1700000000, seed=0):
+    '''
+    Generate a synthetic capture.
+    Input:
+        n_files: int
+            The number of files, taken 60 s apart from start_time.
+        Type: int
+            The packet type indicator of the files (0 fits, 1 csv, ...).
+        Length: int or None
+            The file length in bytes, a 3003x3008 uint16 image if None.
+        loss: float
+            The fraction of lost packets.
+        burst: int
+            The number of consecutive packets lost at once.
+        dup: float
+            The fraction of frames sent twice.
+        corrupt: float
+            The fraction of frames with a bit flipped in the payload.
+        corrupt_header: float
+            The fraction of frames with a bit flipped in the MDPU Length field.
+        crc: tuple or None
+            (begin, end, offset) as FRAME_CRC, to write a CRC-16 in every frame (before the corruption).
+        seed: int
+    Output:
+        capture: bytes
+            The capture.
+        truth: dict
+            UID time -> (Type, Length, lost PSC) of every file.
+    '''
+    rng = np.random.default_rng(seed)
+    Length = IMAGE_LENGTH if Length is None else Length
+    chunks = []
+    truth = {}
+    for k in range(n_files):
+        unix_time = start_time + 60*k
+        n_packets = packet_count(Length)
+        lost = lost_packets(n_packets, loss, burst, rng)
+        psc = np.flatnonzero(~lost) + 1
+        content = file_content(Length, Type, np.random.default_rng([seed, unix_time]))
+        frames = make_frames(unix_time, Type, Length, content, psc)
+        if crc is not None:
+            begin, end, offset = crc
+            starts = np.arange(len(frames))*frames.shape[1] + len(SYNC_MARKER)
+            value = crc16_frames(frames.reshape(-1), starts, begin, end)
+            frames[:, len(SYNC_MARKER)+offset] = value >> 8
+            frames[:, len(SYNC_MARKER)+offset+1] = value & 0xFF
+        bad = np.flatnonzero(rng.random(len(frames)) < corrupt)
+        frames[bad, len(SYNC_MARKER) + PAYLOAD_OFFSET + rng.integers(0, MAX_DATA_SIZE, len(bad))] ^= 0x04
+        bad = np.flatnonzero(rng.random(len(frames)) < corrupt_header)
+        frames[bad, len(SYNC_MARKER) + MDPU_OFFSET + 19] ^= 0x01
+        copies = np.flatnonzero(rng.random(len(frames)) < dup)
+        order = np.sort(np.concatenate([np.arange(len(frames)), copies]), kind='stable')
+        chunks.append(frames[order].reshape(-1))
+        truth[unix_time] = (Type, Length, (np.flatnonzero(lost) + 1).tolist())
+    capture = np.concatenate(chunks).tobytes() if chunks else b''
+    return capture, truth
+
+def generate_request(truth, seed=0):
+    '''
+    The requested data file which completes the files of a capture: the frames of every lost packet.
+    Input:
+        truth: dict
+            The output of generate_capture.
+        seed: int
+            The seed given to generate_capture.
+    '''
+    chunks = []
+    for unix_time, (Type, Length, lost) in truth.items():
+        if lost:
+            content = file_content(Length, Type, np.random.default_rng([seed, unix_time]))
+            chunks.append(make_frames(unix_time, Type, Length, content, np.array(lost)).reshape(-1))
+    return np.concatenate(chunks).tobytes() if chunks else b''
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic X-band capture')
+    parser.add_argument('output')
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--type', type=int, default=0)
+    parser.add_argument('--length', type=int, default=None, help='file length in bytes, a FITS image by default')
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--burst', type=int, default=1)
+    parser.add_argument('--dup', type=float, default=0.0)
+    parser.add_argument('--corrupt', type=float, default=0.0)
+    parser.add_argument('--corrupt-header', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    capture, truth = generate_capture(args.files, args.type, args.length, args.loss, args.burst, args.dup,
+                                      args.corrupt, args.corrupt_header, seed=args.seed)
+    with open(args.output, 'wb') as f:
+        f.write(capture)
+    print(f'{args.output}: {len(capture)} bytes, {len(truth)} files, '
+          f'{sum(len(lost) for _, _, lost in truth.values())} packets lost')
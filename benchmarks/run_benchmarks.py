@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import datetime
+import tempfile
+import tracemalloc
+import subprocess
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from constants import *
+import utility
+import cmd_gen
+import read_bin
+from capture_gen import generate_capture
+
+# Benchmark of the ground station stages on a synthetic capture (see capture_gen.py).
+# Every stage is timed (best and median of --repeat runs) and its peak memory measured with tracemalloc,
+# the results are saved as JSON and can be compared with an earlier run.
+# usage: python benchmarks/run_benchmarks.py [--files 4 --loss 0.01 --burst 5 --output results.json --compare old.json]
+
+def measure(func, repeat, setup=None):
+    '''
+    Run func repeat times.
+    Input:
+        func: callable
+            The stage, called without arguments.
+        repeat: int
+        setup: callable or None
+            Called before every run, not timed.
+    Output:
+        result: dict
+            best and median time in seconds, peak traced memory in MB.
+    '''
+    times, peaks = [], []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 2**20)
+        tracemalloc.stop()
+    return {'best_s': min(times), 'median_s': float(np.median(times)), 'peak_MB': max(peaks)}
+
+def clean(folder):
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    '''
+    Generate the capture in a temporary folder and measure every stage there
+    (the stages use the relative ./tmp/ and ./Mission_data/ folders).
+    '''
+    results = {}
+    capture, truth = generate_capture(args.files, args.type, args.length, args.loss, args.burst, args.dup,
+                                      args.corrupt, args.corrupt_header, seed=args.seed)
+    capture_complete, _ = generate_capture(args.files, args.type, args.length, seed=args.seed)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            with open('raw.bin', 'wb') as f:
+                f.write(capture)
+            with open('complete.bin', 'wb') as f:
+                f.write(capture_complete)
+            for Type in MISSION_TYPES:
+                os.makedirs(f'./Mission_data/{Type}/')
+
+            results['DF_raw_data'] = measure(lambda: utility.DF_raw_data('raw.bin'), args.repeat)
+            results['load_raw_data'] = measure(lambda: utility.load_raw_data('raw.bin'), args.repeat)
+
+            Data = utility.load_raw_data('raw.bin')
+            results['find_missing_packets'] = measure(lambda: [utility.find_missing_packets(data) for data in Data],
+                                                      args.repeat)
+
+            incomplete = [data for data in Data if 0 < utility.find_missing_packets(data)[1] < 100]
+            def encode():
+                for data in incomplete:
+                    utility.encode_data(f'./tmp/tmp_{data.Filename}', data)
+            results['encode_data'] = measure(encode, args.repeat, setup=lambda: clean('./tmp'))
+            results['DF_tmp_data'] = measure(lambda: [utility.DF_tmp_data(f'./tmp/tmp_{data.Filename}')
+                                                      for data in incomplete], args.repeat)
+
+            Complete = utility.load_raw_data('complete.bin')
+            results['compile_data'] = measure(lambda: read_bin.compile_data(Complete), args.repeat,
+                                              setup=lambda: [clean(f'./Mission_data/{Type}') for Type in MISSION_TYPES])
+
+            rows = [[data.Filename, 'Missing', segment[0], segment[1], missing_rate]
+                    for data in Data
+                    for missing_seg, missing_rate in [utility.find_missing_packets(data)] if missing_seg != -1
+                    for segment in missing_seg]
+            rows *= args.row_scale
+            def order():
+                os.makedirs('./cmd/list/bench/', exist_ok=True)
+                cmd_gen.command_order([list(row) for row in rows], './cmd/list/bench/', 16621, 5, 80, 16621, None)
+            results['command_order'] = measure(order, args.repeat, setup=lambda: clean('./cmd/list/bench'))
+        finally:
+            os.chdir(cwd)
+
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'parameters': vars(args) | {'capture_bytes': len(capture), 'un_gen_rows': len(rows),
+                                    'lost_packets': sum(len(lost) for _, _, lost in truth.values())},
+        'results': results,
+    }
+
+def compare(report, baseline):
+    '''
+    Print the time and memory of each stage relative to a baseline report (> 1 is slower / larger).
+    '''
+    print(f'\n{"stage":>22} {"time ratio":>11} {"memory ratio":>13}')
+    for stage, result in report['results'].items():
+        if stage not in baseline['results']:
+            continue
+        base = baseline['results'][stage]
+        time_ratio = result['best_s'] / base['best_s'] if base['best_s'] else float('nan')
+        mem_ratio = result['peak_MB'] / base['peak_MB'] if base['peak_MB'] else float('nan')
+        print(f'{stage:>22} {time_ratio:11.2f} {mem_ratio:13.2f}')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the ground station stages')
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--type', type=int, default=0)
+    parser.add_argument('--length', type=int, default=None, help='file length in bytes, a FITS image by default')
+    parser.add_argument('--loss', type=float, default=0.01)
+    parser.add_argument('--burst', type=int, default=5)
+    parser.add_argument('--dup', type=float, default=0.001)
+    parser.add_argument('--corrupt', type=float, default=0.0)
+    parser.add_argument('--corrupt-header', type=float, default=0.0)
+    parser.add_argument('--row-scale', type=int, default=1, help='repeat the un_gen rows given to command_order')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', default=None, help='an earlier JSON result to compare with')
+    args = parser.parse_args()
+
+    report = run(argparse.Namespace(**{k: v for k, v in vars(args).items() if k not in ('output', 'compare')}))
+    print(f'{"stage":>22} {"best [s]":>10} {"median [s]":>11} {"peak [MB]":>10}')
+    for stage, result in report['results'].items():
+        print(f'{stage:>22} {result["best_s"]:10.4f} {result["median_s"]:11.4f} {result["peak_MB"]:10.1f}')
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results saved to {args.output}')
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
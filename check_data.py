@@ -6,75 +6,124 @@ import pandas as pd
 
 from constants import *
 from utility import process_packet # for DF_raw_data
-from utility import DF_raw_data
+from utility import load_raw_data
 from utility import find_consecutive_ranges # for find_missing_packets
 from utility import find_missing_packets
-from utility import encode_data
+from utility import write_reports
+from utility import conflict_rows
+from utility import record_file
+from utility import wait_writes
+from utility import compile_store
+from partial_store import PartialStore
+import metrics
 
-# get the file name to be checked
-file_path = sys.argv[1]
-
-def main():
+def check(file_path):
     
-    # create a output file if needed 
-    # determine report file
-    if os.path.isfile('./report/un_gen.csv'):
-        fout_name_incpl = './report/un_gen.csv'
-    else:
-        fout_name_incpl = './report/un_gen.csv'
-        with open(fout_name_incpl, 'w') as f:
-            f.write(csv_header)
-    print(f'Report file: {fout_name_incpl}')
-    if os.path.isfile('./report/final_check.csv'):
-        fout_name_cpl = './report/final_check.csv'
-    else:
-        fout_name_cpl = './report/final_check.csv'
-        with open(fout_name_cpl, 'w') as f:
-            f.write(csv_header)
-    print(f'Report file: {fout_name_cpl}')
+    '''
+    Check the files in a raw data file: complete files are compiled, incomplete files are merged into their
+    partial store in ./tmp/ and reported from it, so a file spread over several raw files is compiled once complete.
+    The report rows are returned rather than written, so that several raw files can be checked
+    concurrently and their reports written by a single process.
+    Input:
+        file_path: str
+            The path of the raw data file.
+    Output:
+        report_incpl: list of lists
+            The rows for the un_gen report (Filename, Type, Start_Packet_number, End_Packet_number, Incompleteness).
+        report_cpl: list of lists
+            The rows for the final_check report.
+        status: int
+            The exit status of check_data.py, 0 if every file could be checked.
+    '''
     
-    Data = DF_raw_data(file_path)
+    report_incpl, report_cpl = [], []
     
-    filenames = set(list(Data['Filename']))
+    status = 0
+    try:
+        Data = load_raw_data(file_path)
         
-    for filename in filenames:
+        for data in Data:
         
-        try:
-            data = Data[Data['Filename'] == filename]
-            missing_seg, missing_rate = find_missing_packets(data)
+            filename = data.Filename
+            # copies of a packet with different payloads in the capture
+            report_incpl += conflict_rows(filename, data.conflict_psc, data.n_packets)
+            try:
+                missing_seg, missing_rate = find_missing_packets(data)
+                outfile = f'./tmp/tmp_{filename}'
     
-            if missing_seg == -1:
-                # the file is empty, report it
-                with open(fout_name_incpl, 'a') as f:
-                    f.write(f'{filename},Error,65535,65535,100\n')
+                if missing_seg == -1:
+                    # the file is empty, report it
+                    record_file(data, 'error')
+                    report_incpl.append([filename, 'Error', 65535, 65535, 100])
+
+                elif missing_rate == 0 and not os.path.exists(outfile):
+                    # the file is complete, save the mission data
+                    record_file(data, 'complete')
+                    from read_bin import compile_data
+                    with metrics.timer('compile'):
+                        compile_data([data], wait=False)
+                    # output the report for the complete file
+                    report_cpl.append([filename, 'OK', 0, 0, 0])
                     
-            elif missing_rate >= MISSINGRATE_TOLERANCE:
-                # the file is completely missing, report it
-                with open(fout_name_incpl, 'a') as f:
-                    f.write(f'{filename},Error,65535,65535,100\n')
+                elif missing_rate >= MISSINGRATE_TOLERANCE and not os.path.exists(outfile):
+                    # the file is completely missing and no earlier capture has its packets, report it
+                    record_file(data, 'error')
+                    report_incpl.append([filename, 'Error', 65535, 65535, 100])
 
-            elif missing_rate < MISSINGRATE_TOLERANCE:
-                # save the incomplete file
-                outfile = f'./tmp/tmp_{filename}'
-                encode_data(outfile, data)
-                # output the report for the missing packets
-                with open(fout_name_incpl, 'a') as f:
-                    for segment in missing_seg:
-                        f.write(f'{filename},Missing,{segment[0]},{segment[1]},{missing_rate}\n')
+                else:
+                    # save the incomplete file, merged with the packets of earlier captures of the same file
+                    with PartialStore.open_or_create(outfile, filename, data.Type, data.Length, INCREMENTAL_OUTPUT) as store:
+                        metrics.inc('packets_written', store.write_packets(data))
+                        # copies with another payload than the packets of the earlier captures
+                        report_incpl += conflict_rows(filename, store.conflict_psc, store.n_packets)
+                        # the missing packets of the file are the ones missing in the store, not in this capture
+                        missing_seg, missing_rate = find_missing_packets(store.completeness)
+                        # the worker which completes the store compiles the file, under the lock of the store
+                        compiled = store.compiled
+                        if missing_rate == 0 and not compiled:
+                            compile_store(store)
 
-            elif missing_rate == 0:
-                # the file is complete, save the mission data
-                from read_bin import compile_data
-                compile_data(Data)
-                # output the report for the complete file
-                with open(fout_name_cpl, 'a') as f:
-                    f.write(f'{filename},OK,0,0,0\n')
-                        
-        except Exception as e:
-            # report for unreadable files
-            with open(fout_name_incpl, 'a') as f:
-                f.write(f'{filename},Error,65535,65535,100\n')
-            sys.exit(1)
+                    if missing_rate == 0 and compiled:
+                        # the file was already compiled from the store (another capture of the same file)
+                        record_file(data, 'complete', store.completeness)
+                    elif missing_rate == 0:
+                        # the earlier captures completed the file, save the mission data
+                        record_file(data, 'complete', store.completeness)
+                        report_cpl.append([filename, 'OK', 0, 0, 0])
+                    elif missing_rate >= MISSINGRATE_TOLERANCE:
+                        # still completely missing, report it
+                        record_file(data, 'error', store.completeness)
+                        report_incpl.append([filename, 'Error', 65535, 65535, 100])
+                    else:
+                        # output the report for the missing packets
+                        record_file(data, 'incomplete', store.completeness)
+                        for segment in missing_seg:
+                            report_incpl.append([filename, 'Missing', segment[0], segment[1], missing_rate])
+        
+            except SystemExit as e:
+                # compile_data failed, keep the reports of the files checked so far
+                status = e.code
+                break
+            except Exception as e:
+                # report for unreadable files
+                report_incpl.append([filename, 'Error', 65535, 65535, 100])
+                status = 1
+                break
+    finally:
+        # the FITS files of this raw file written in the background, on every exit path
+        report_cpl, failed = wait_writes(report_cpl)
+    
+    if failed and status == 0:
+        status = 4
+    return report_incpl, report_cpl, status
+
+def main(file_path):
+    
+    report_incpl, report_cpl, status = check(file_path)
+    write_reports(report_incpl, report_cpl)
+    if status != 0:
+        sys.exit(status)
         
 if __name__ == "__main__":
-    main()
+    # get the file name to be checked
+    main(sys.argv[1])
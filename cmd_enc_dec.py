@@ -1,5 +1,6 @@
 import sys
-import datetime
+import numpy as np
+from uid_codec import unix_from_uid, uid_from_unix, uid_string
 
 #file_name = 'F20540802065959.bin'
 #id_start = 16000
@@ -10,14 +11,7 @@ import datetime
 def make_command(file_name,id_start,id_end,N):
     # 4 bytes file name ,3 bytes sequence number, 2 bytes number packet from seq number, 1 byte how many times
     #F20YYMMDDhhmmss
-    YY = int(file_name[3:5])
-    MM = int(file_name[5:7])
-    DD = int(file_name[7:9])
-    hh = int(file_name[9:11])
-    mm = int(file_name[11:13])
-    ss = int(file_name[13:15])
-    fname = datetime.datetime(2000+YY,MM,DD,hh,mm,ss)
-    unix_time = int(fname.timestamp())
+    unix_time = unix_from_uid(file_name)
     out_date = unix_time.to_bytes(4,'big')
 
     #UNIX timestamp
@@ -29,12 +23,68 @@ def make_command(file_name,id_start,id_end,N):
         
     return out_date + id + n
 
+#######################################################################
+SYNC_CMD = bytes.fromhex('cbda')
+CMD_SIZE = 10
+# hex digits of every byte value, for make_command_text
+HEX_DIGITS = np.frombuffer(''.join(f'{b:02x}' for b in range(256)).encode(), dtype=np.uint8).reshape(256, 2)
+
+def make_commands(file_names,id_start,id_end,N):
+    '''
+    Encode a table of commands in one pass, the vectorized make_command.
+    Input:
+        file_names: sequence of str or int
+            File name (F20YYMMDDhhmmss.bin) or UID of every command.
+        id_start, id_end, N: array-like of int
+            As in make_command.
+    Output:
+        cmds: ndarray (n, CMD_SIZE) uint8
+            cmds[i].tobytes() == make_command(file_names[i], id_start[i], id_end[i], N[i])
+    '''
+    names, inverse = np.unique(np.asarray([str(f) for f in file_names]), return_inverse=True)
+    unix_time = np.array([unix_from_uid(name) for name in names], dtype=np.int64)[inverse.reshape(-1)]
+    id_start = np.asarray(id_start, dtype=np.int64).reshape(-1)
+    number = np.asarray(id_end, dtype=np.int64).reshape(-1) - id_start + 1
+    N = np.broadcast_to(np.asarray(N, dtype=np.int64), id_start.shape)
+    for value, size in [(unix_time, 4), (id_start, 3), (number, 2), (N, 1)]:
+        if len(value) and (value.min() < 0 or value.max() >= 1 << (8*size)):
+            raise OverflowError('int too big to convert')
+
+    cmds = np.empty((len(id_start), CMD_SIZE), dtype=np.uint8)
+    cmds[:, 0:4] = unix_time.astype('>u4').view(np.uint8).reshape(-1, 4)
+    cmds[:, 4:7] = id_start.astype('>u4').view(np.uint8).reshape(-1, 4)[:, 1:]
+    cmds[:, 7:9] = number.astype('>u2').view(np.uint8).reshape(-1, 2)
+    cmds[:, 9] = N
+    return cmds
+
+def make_command_text(cmds):
+    '''
+    The text lines of the cmd report for the commands of make_commands,
+    'cb da' + ' '.join(f'{b:02x}' for b in command) + '\\n' for every command, as one bytes object.
+    '''
+    n = len(cmds)
+    prefix = len('cb da')
+    lines = np.full((n, prefix + 3*CMD_SIZE), ord(' '), dtype=np.uint8)
+    lines[:, :prefix] = np.frombuffer(b'cb da', dtype=np.uint8)
+    digits = HEX_DIGITS[cmds].reshape(n, CMD_SIZE, 2)
+    lines[:, prefix:].reshape(n, CMD_SIZE, 3)[:, :, :2] = digits
+    lines[:, -1] = ord('\n')
+    return lines.tobytes()
+
+def make_command_binary(cmds):
+    '''
+    The binary commands of make_commands, SYNC_CMD (cb da) + the command for every command, as one bytes object.
+    '''
+    frames = np.empty((len(cmds), len(SYNC_CMD) + CMD_SIZE), dtype=np.uint8)
+    frames[:, :len(SYNC_CMD)] = np.frombuffer(SYNC_CMD, dtype=np.uint8)
+    frames[:, len(SYNC_CMD):] = cmds
+    return frames.tobytes()
+
 ######################################################################
 def decode_command(com):
     
     com = com[2:]
-    fname = datetime.datetime.fromtimestamp(int.from_bytes(com[:4],'big'))
-    file_name = f'{fname:%Y%m%d%H%M%S}'
+    file_name = uid_string(uid_from_unix(int.from_bytes(com[:4],'big')))
     #UNIX timestamp
 
     id_start=int.from_bytes(com[5:8],'big')
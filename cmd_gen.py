@@ -1,21 +1,22 @@
-import datetime
 import os
 import glob
 import pandas as pd
 import sys
 import cmd_enc_dec as myenc
+import uid_codec
 import numpy as np
+import heapq
+import bisect
 # import binascii
 import csv
+from report_store import ReportStore
 
 #NOTFIXED: not fixed part
 #######################################################################
 def main():
     #NOTFIXED_START
     #time used in file name in command list
-    t_delta = datetime.timedelta(hours=9)
-    JST = datetime.timezone(t_delta, 'JST')
-    now = datetime.datetime.now(JST)
+    now = uid_codec.now()
 
     #variables
     # cmd output file name
@@ -30,40 +31,57 @@ def main():
     total_packet = 16621    
     #if the fraction of requested packets is larger than this, all data is requested
     rate_for_all = 0.8*100
+    #fill the request files by bin packing (fewer request files) instead of in file order
+    bin_packing = False
+    #also write the commands in binary
+    cmd_binary = False
+    #choose the requests of a pass with the uplink/downlink budgets of scheduler.py (UPLINK_BUDGET, DOWNLINK_WINDOW)
+    use_scheduler = False
 
     #folders
     folder_cmd_list = './cmd/list/' 
     folder_cmd_list_cur = folder_cmd_list +  f'{now:%Y%m%d_%H%M%S}' + '/'
     #NOTFIXED_END
 
-    file_name = folder_decode_out + 'un_gen.csv'
-    try:
-        list_packet_t = pd.read_csv(file_name).values.tolist() #csv /w header
-    except:
-        # Not triggered if no un_gen.csv file (no new data)
+    store = ReportStore(folder_decode_out + 'report.db')
+    ids, list_packet_t = store.fetch('un_gen')
+    if len(list_packet_t) == 0:
+        # Not triggered if no un_gen rows (no new data)
+        store.close()
         return 0
     
     os.makedirs(folder_cmd_list_cur[:-1])
     # os.makedirs(folder_cmd_bin_cur[:-1])
-    command_order(folder_decode_out,folder_cmd_list_cur,N_request,N_id,rate_for_all,total_packet,now)
-    command_bin(folder_cmd_list_cur,cmd_out)
+    if use_scheduler:
+        import scheduler
+        # the rows which did not fit in the budgets stay in un_gen for the next pass
+        scheduled = scheduler.command_schedule(list_packet_t,folder_cmd_list_cur,N_request,N_id,rate_for_all,total_packet,now)
+        ids = [ids[i] for i in scheduled]
+    else:
+        command_order(list_packet_t,folder_cmd_list_cur,N_request,N_id,rate_for_all,total_packet,now,bin_packing)
+    command_bin(folder_cmd_list_cur,cmd_out,cmd_binary)
+    # the requested rows leave un_gen for the report history, in one transaction
+    store.archive(ids)
+    store.export_csv(folder_decode_out)
+    store.close()
         
 #######################################################################
-def command_bin(folder_list,folder_cmd):
+def command_bin(folder_list,folder_cmd,binary=False):
     #generate command for request
+    #binary: also write the binary commands (cb da + 10 bytes) to a .bin file next to the cmd report
     
     # determine the ouptput file name
     cmd_report = glob.glob('./cmd/*.txt')
     cmd_report.sort()
     if len(cmd_report) == 0:
-        dt_now = datetime.datetime.now()
+        dt_now = uid_codec.now()
         time_now = dt_now.strftime('%Y%m%d%H%M%S')
         fout_name = f'./cmd/cmd_report_0000_{time_now}.txt'
     else:
         fout_name = cmd_report[-1]
         if os.path.getsize(fout_name) > 33*1000-1: # one line is 33 bytes 
             print('The last cmd report file is too large, create a new one.')
-            dt_now = datetime.datetime.now()
+            dt_now = uid_codec.now()
             time_now = dt_now.strftime('%Y%m%d%H%M%S')
             fout_name = f'./cmd/report_{str(len(cmd_report)).zfill(4)}_{time_now}.txt'
         else:
@@ -72,42 +90,41 @@ def command_bin(folder_list,folder_cmd):
     #############################
     # generate command for request
     #NOTFIXED_START
-    files = glob.glob(folder_list + 'REQ*.csv') #list for request
+    files_req = sorted(glob.glob(folder_list + 'REQ*.csv')) #list for request
+    files_del = sorted(glob.glob(folder_list + 'DEL*.csv')) #list for delete
     #NOTFIXED_END
-    files.sort()
-    
-    if(len(files)>0):
-        for file_name in files:
-            list_packet_t = pd.read_csv(file_name).values.tolist()
-            for lists in list_packet_t:
-                # print(file_name, list_packet_t) # xxx
-                out_cmd_b = myenc.make_command(lists[0],lists[1],lists[2],lists[3])
-                with open(fout_name , 'a') as f:
-                    # f.write('cb da'+str(binascii.hexlify(out_cmd_b, ' '))[2:-1]+'\n')
-                    # python version < 3.8
-                    f.write('cb da' + ' '.join(f'{b:02x}' for b in out_cmd_b) + '\n')
-
-    # generate command for delete
-    #NOTFIXED_START                
-    files = glob.glob(folder_list + 'DEL*.csv')#list for delete
-    #NOTFIXED_END    
-    files.sort()
-    
-    if(len(files)>0):
-        for file_name in files:
-            list_packet_t = pd.read_csv(file_name).values.tolist()
-            for lists in list_packet_t:
-                out_cmd_b = myenc.make_command(lists[0],lists[1],0,0) #command for delete file (not fixed yet?)
-                with open(fout_name , 'a') as f:
-                    # f.write('cb da'+str(binascii.hexlify(out_cmd_b, ' '))[2:-1]+'\n')
-                    # python version < 3.8
-                    f.write('cb da' + ' '.join(f'{b:02x}' for b in out_cmd_b) + '\n')
-                    
+    req_list = read_lists(files_req)
+    del_list = read_lists(files_del)
+
+    # all the commands are encoded at once and written with a single call
+    # request: packets Start..End of the file, sent once (N=1)
+    # delete: N=0 (command for delete file, not fixed yet?)
+    file_names = list(req_list['Filename']) + list(del_list['Filename'])
+    if len(file_names) == 0:
+        return
+    id_start = np.concatenate([req_list['Start_Packet_number'].to_numpy(np.int64), np.zeros(len(del_list), dtype=np.int64)])
+    id_end = np.concatenate([req_list['End_Packet_number'].to_numpy(np.int64), np.zeros(len(del_list), dtype=np.int64)])
+    N = np.concatenate([np.ones(len(req_list), dtype=np.int64), np.zeros(len(del_list), dtype=np.int64)])
+    cmds = myenc.make_commands(file_names,id_start,id_end,N)
+    with open(fout_name , 'ab') as f:
+        # 'cb da' + ' '.join(f'{b:02x}' for b in out_cmd_b) + '\n' per command
+        f.write(myenc.make_command_text(cmds))
+    if binary:
+        with open(fout_name[:-4] + '.bin' , 'ab') as f:
+            f.write(myenc.make_command_binary(cmds))
+
     #############################
 
+#read the REQ/DEL lists into one table
+def read_lists(files):
+    if len(files) == 0:
+        return pd.DataFrame(columns=['Filename','Type','Start_Packet_number','End_Packet_number'])
+    return pd.concat([pd.read_csv(file_name, dtype={'Filename': str}) for file_name in files], ignore_index=True)
+
 #######################################################################
-def command_order(fol_dout,fol_lis,N_req,N_id,rate_for_all,total_packet,now):
-    file_name = fol_dout + 'un_gen.csv'
+def command_order(list_packet_t,fol_lis,N_req,N_id,rate_for_all,total_packet,now,bin_packing=False):
+    #list_packet_t: rows of the un_gen report
+    #bin_packing: fill the request files with best-fit decreasing instead of in file order
     #list of request    
     list_packet = []
     #list of all data request    
@@ -115,8 +132,6 @@ def command_order(fol_dout,fol_lis,N_req,N_id,rate_for_all,total_packet,now):
     #list of OK packet    
     list_OK = []       
     #Categorized in each list
-    list_packet_t = pd.read_csv(file_name).values.tolist() #csv /w header
-    add_csv(fol_dout + 'report.csv',list_packet_t)    
     for pac_t in list_packet_t:
         if (pac_t[4] < rate_for_all and pac_t[1] != 'OK' and pac_t[1] != 'Error'):
             list_packet.append(pac_t)
@@ -128,12 +143,12 @@ def command_order(fol_dout,fol_lis,N_req,N_id,rate_for_all,total_packet,now):
             print("ERROR in command_order: unknown category")
             sys.exit()
             
-    #list of raw file
-    file_id = set([row[0] for row in list_packet])
-    #Summarized by raw file, list_packet_sum[i] is a list of packet with a same file name
-    list_packet_sum = [[row for row in list_packet if row[0] == id] for id in file_id]
+    #Summarized by raw file in a single pass, list_packet_sum[id] is a list of packet with a same file name
+    list_packet_sum = {}
+    for row in list_packet:
+        list_packet_sum.setdefault(row[0], []).append(row)
     #sort so that older file former
-    sorted_list_pac = sorted(list_packet_sum, key = lambda x: x[0][0][1:-4])
+    sorted_list_pac = [list_packet_sum[id] for id in sorted(list_packet_sum, key=file_order)]
 
     #NOTFIXED_START
     #shorten number of packets > N_id
@@ -143,23 +158,11 @@ def command_order(fol_dout,fol_lis,N_req,N_id,rate_for_all,total_packet,now):
     #NOTFIXED_END
 
     #make a list : number of packets < N_req
-    len_req = 0
-    com_list = []
+    segments = [row for pac_t in sorted_list_pac for row in add_request_rate(pac_t,total_packet)]
     n_csv = 0
-    for pac_t in sorted_list_pac:
-        pac_t = add_request_rate(pac_t,total_packet)
-        for i in range(len(pac_t)):
-            len_req += pac_t[i][3] - pac_t[i][2] + 1
-            if(len_req < N_req):
-                com_list.append(pac_t[i])
-            else:
-                save_to_csv(fol_lis + 'REQ',n_csv,com_list)
-                len_req = 0 
-                com_list = []
-                n_csv += 1
-                i = i-1
-    save_to_csv(fol_lis + 'REQ',n_csv,com_list)
-    n_csv += 1
+    for com_list in pack_requests(segments,N_req,bin_packing):
+        save_to_csv(fol_lis + 'REQ',n_csv,com_list)
+        n_csv += 1
 
     #make a list : request all packet
     for pac_t in list_for_all:
@@ -175,23 +178,74 @@ def command_order(fol_dout,fol_lis,N_req,N_id,rate_for_all,total_packet,now):
         pac_t.append(0) #rate for request
         save_to_csv(fol_lis + 'DEL',n_csv,[pac_t])
         n_csv += 1
-
-    os.remove(file_name)
     
 
 #######################################################################
 #reduce the number of command by combining missed packets
 #NOTFIXED_START
 def list_shorten(lists,N_id):
-    while (len(lists)>N_id):
-        length_lists = np.array([lists[i+1][2]-lists[i][3] for i in range(len(lists)-1)])
-        length_min = np.min(length_lists)
-        i_merge = np.where(length_lists == length_min)[0][0]
-        list_add = [lists[i_merge][0],lists[i_merge][1],lists[i_merge][2],lists[i_merge+1][3],lists[i_merge][4]]
-        lists = lists[:i_merge] + [list_add] + lists[i_merge+2:]
-    return lists
+    # Merging two neighbouring segments removes the gap between them and leaves the other gaps unchanged,
+    # so merging the smallest gap one at a time (leftmost first on a tie) removes the len-N_id smallest gaps.
+    # Pick them with a heap and merge the runs of segments in one pass, O(n log n).
+    n_merge = len(lists) - N_id
+    if n_merge <= 0:
+        return lists
+    gaps = ((lists[i+1][2]-lists[i][3], i) for i in range(len(lists)-1))
+    merged = np.zeros(len(lists), dtype=bool) # merged[i]: lists[i] and lists[i+1] are merged
+    for gap, i in heapq.nsmallest(n_merge, gaps):
+        merged[i] = True
+    list_out = []
+    for i in range(len(lists)):
+        if i > 0 and merged[i-1]:
+            first = list_out[-1]
+            list_out[-1] = [first[0],first[1],first[2],lists[i][3],first[4]]
+        else:
+            list_out.append(lists[i])
+    return list_out
 #NOTFIXED_END
 
+#######################################################################
+#order of the raw files: the file UID (older file former), Fxxx.bin for the older file names
+def file_order(Filename):
+    name = str(Filename)
+    if name.startswith('F') and name.endswith('.bin'):
+        name = name[1:-4]
+    return name
+
+#split the segments into request files of less than N_req packets
+#a segment which does not fit in the current request file starts the next one
+def pack_requests(segments,N_req,bin_packing=False):
+    if len(segments) == 0:
+        return []
+    n_packet = np.array([seg[3]-seg[2]+1 for seg in segments], dtype=np.int64)
+    if bin_packing:
+        return pack_best_fit(segments,n_packet,N_req)
+    cum_packet = np.cumsum(n_packet)
+    batches = []
+    start = 0
+    while start < len(segments):
+        base = cum_packet[start-1] if start > 0 else 0
+        end = max(int(np.searchsorted(cum_packet, base + N_req, side='left')), start + 1)
+        batches.append(segments[start:end])
+        start = end
+    return batches
+
+#best-fit decreasing: fewer request files, each file keeps the segments in file order
+def pack_best_fit(segments,n_packet,N_req):
+    free = [] # sorted (free packets, batch index)
+    batches = []
+    for i in np.argsort(-n_packet, kind='stable'):
+        k = bisect.bisect_right(free, (int(n_packet[i]), -1))
+        if k < len(free):
+            space, j = free.pop(k)
+        else:
+            space, j = N_req - 1, len(batches)
+            batches.append([])
+        batches[j].append(i)
+        if space - n_packet[i] > 0:
+            bisect.insort(free, (int(space - n_packet[i]), j))
+    return [[segments[i] for i in sorted(batch)] for batch in batches]
+
 #######################################################################
 #add request rate per one raw file FymdHMS.bin
 def add_request_rate(lists,total_packet):
@@ -209,16 +263,7 @@ def save_to_csv(folder_name,n_c,data):
         file.write('Filename,Type,Start_Packet_number,End_Packet_number,Incompleteness,req_rate\n')
         writer = csv.writer(file)
         writer.writerows(data)   
-                
-def add_csv(file_name, new_data):
-    try:
-        df = pd.read_csv(file_name).values.tolist()
-        df.append(new_data)
-    except FileNotFoundError:
-        df = new_data
-    with open(file_name, mode = 'a', newline = '') as file:
-        writer = csv.writer(file)
-        writer.writerows(new_data)
+
 #######################################################################
 if __name__ == "__main__":
     main()
\ No newline at end of file
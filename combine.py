@@ -7,91 +7,125 @@ import pandas as pd
 
 from constants import *
 from utility import process_packet # for DF_raw_data
-from utility import DF_raw_data
+from utility import load_raw_data
 from utility import encode_data
 from utility import find_consecutive_ranges # for find_missing_packets
 from utility import find_missing_packets
-from utility import DF_tmp_data
+from utility import load_tmp_data
+from utility import write_reports
+from utility import conflict_rows
+from utility import record_file
+from utility import wait_writes
+from utility import compile_store
+import metrics
+from partial_store import PartialStore, is_store
 
 output_IM_folder_path = "./optical/"
 
-def main():
+def combine(requested_file):
     
-    if os.path.isfile('./report/un_gen.csv'):
-        fout_name_incpl = './report/un_gen.csv'
-    else:
-        fout_name_incpl = './report/un_gen.csv'
-        with open(fout_name_incpl, 'w') as f:
-            f.write(csv_header)
-    print(f'Report file: {fout_name_incpl}')
-    if os.path.isfile('./report/final_check.csv'):
-        fout_name_cpl = './report/final_check.csv'
-    else:
-        fout_name_cpl = './report/final_check.csv'
-        with open(fout_name_cpl, 'w') as f:
-            f.write(csv_header)
-    print(f'Report file: {fout_name_cpl}')
+    '''
+    Fill the tmp files in ./tmp/ with the packets of a requested data file.
+    Files which become complete are compiled. The report rows are returned rather than written (see check_data.check).
+    Input:
+        requested_file: str
+            The path of the requested data file.
+    Output:
+        report_incpl: list of lists
+            The rows for the un_gen report (Filename, Type, Start_Packet_number, End_Packet_number, Incompleteness).
+        report_cpl: list of lists
+            The rows for the final_check report.
+        status: int
+            The exit status of combine.py, 0 if the requested file could be read.
+    '''
     
-    requested_file = sys.argv[1]
+    report_incpl, report_cpl = [], []
     
+    status = 0
     try:
-        requested_Data = DF_raw_data(requested_file) # PLEASE CHECK the format of requested file!
-        requested_files = list(set(requested_Data['Filename']))
+        requested_Data = load_raw_data(requested_file) # PLEASE CHECK the format of requested file!
         
-        for filename in requested_files:
+        for requested_data in requested_Data:
             
-            tmp_file = glob.glob(f'./tmp/tmp_{filename}')[0]
+            filename = requested_data.Filename
+            tmp_file = glob.glob(f'./tmp/tmp_{filename}')
             
             if len(tmp_file) == 0:
                 print(f'Extracting required file {requested_file}. tmp file {filename} not found.')
                 continue
             
-            # load the incomplete data from tmp file
-            tmp_data = DF_tmp_data(tmp_file)
-            # extract the requested data from requested_Data to fill the missing packets
-            requested_data = requested_Data[requested_Data['Filename'] == filename]
-            requested_data = requested_data.drop_duplicates(subset=['PSC'])
-            requested_data = requested_data.sort_values(by='PSC')
-            # append requested_data to tmp_data
-            updated_data = pd.concat([tmp_data, requested_data], ignore_index=True)
-            updated_data = updated_data.drop_duplicates(subset=['PSC'])
-            updated_data = updated_data.sort_values(by='PSC')
-            # check the integrity of the updated data
-            missing_seg, missing_rate = find_missing_packets(updated_data)
+            # tmp files of the older format are converted to a partial store first
+            if not is_store(tmp_file[0]):
+                table = load_tmp_data(tmp_file[0])
+                if filename in table:
+                    encode_data(tmp_file[0], table[filename])
+                else:
+                    # no packets of this file in the tmp file, start a new store for the requested packets
+                    PartialStore.create(tmp_file[0], filename, requested_data.Type, requested_data.Length, INCREMENTAL_OUTPUT).close()
+            
+            with PartialStore.open(tmp_file[0]) as store:
+                # write only the requested packets which are missing in the tmp file, in place
+                metrics.inc('packets_written', store.write_packets(requested_data))
+                metrics.inc('packets_duplicate', requested_data.n_duplicates)
+                metrics.inc('packets_conflict', len(requested_data.conflict_psc))
+                # copies with different payloads, in the requested file or against the tmp file
+                conflict_psc = requested_data.conflict_psc | store.conflict_psc
+                report_incpl += conflict_rows(filename, conflict_psc, store.n_packets)
+                # check the integrity of the updated data
+                missing_seg, missing_rate = find_missing_packets(store.completeness)
+                # the worker which completes the store compiles the file, under the lock of the store
+                compiled = store.compiled
+                if missing_rate == 0 and not compiled:
+                    compile_store(store)
             
             
             if missing_seg == -1:
                 # the file is empty, report it
-                with open(fout_name_incpl, 'a') as f:
-                    f.write(f'{filename},Error,65535,65535,100\n')
+                record_file(store, 'error')
+                report_incpl.append([filename, 'Error', 65535, 65535, 100])
                     
             elif missing_rate >= MISSINGRATE_TOLERANCE:
                 # the file is completely missing, report it
-                with open(fout_name_incpl, 'a') as f:
-                    f.write(f'{filename},Error,65535,65535,100\n')
+                record_file(store, 'error')
+                report_incpl.append([filename, 'Error', 65535, 65535, 100])
 
-            elif missing_rate < MISSINGRATE_TOLERANCE:
-                # save the incomplete file
-                outfile = f'./tmp/tmp_{filename}'
-                encode_data(outfile, updated_data)
-                # output the report for the missing packets
-                with open(fout_name_incpl, 'a') as f:
-                    for segment in missing_seg:
-                        f.write(f'{filename},Missing,{segment[0]},{segment[1]},{missing_rate}\n')
+            elif missing_rate == 0 and compiled:
+                # the file was already compiled from the tmp file
+                record_file(store, 'complete')
 
             elif missing_rate == 0:
                 # the file is complete, save the mission data
-                from read_bin import compile_data
-                compile_data(updated_data)
+                record_file(store, 'complete')
                 # output the report for the complete file
-                with open(fout_name_cpl, 'a') as f:
-                    f.write(f'{filename},OK,0,0,0\n')
+                report_cpl.append([filename, 'OK', 0, 0, 0])
+
+            elif missing_rate < MISSINGRATE_TOLERANCE:
+                # the incomplete file is already saved in the tmp file
+                record_file(store, 'incomplete')
+                # output the report for the missing packets
+                for segment in missing_seg:
+                    report_incpl.append([filename, 'Missing', segment[0], segment[1], missing_rate])
             
-    
+    except SystemExit as e:
+        # compile_data failed, keep the reports of the files combined so far
+        status = e.code
     except Exception as e:
         print(f"Error: {e}. Input file unknown.")
-        sys.exit(3)
-
+        status = 3
+    finally:
+        # the FITS files of this requested file written in the background, on every exit path
+        report_cpl, failed = wait_writes(report_cpl)
+    
+    if failed and status == 0:
+        status = 4
+    return report_incpl, report_cpl, status
 
+def main(requested_file):
+    
+    report_incpl, report_cpl, status = combine(requested_file)
+    write_reports(report_incpl, report_cpl)
+    if status != 0:
+        sys.exit(status)
 
-                
\ No newline at end of file
+if __name__ == "__main__":
+    main(sys.argv[1])
@@ -0,0 +1,70 @@
+import numpy as np
+
+class Completeness:
+    '''
+    Track which packets (PSC 1..n_packets) of a file have been received.
+    Attributes:
+        n_packets: int
+            The number of packets of the file.
+        received: ndarray (n_packets,) bool
+            received[p-1] is True if the packet PSC p has been received.
+        n_received: int
+            The number of distinct packets received.
+    '''
+
+    def __init__(self, n_packets):
+        self.n_packets = int(n_packets)
+        self.received = np.zeros(self.n_packets, dtype=bool)
+        self.n_received = 0
+
+    def mark_received(self, psc):
+        '''
+        Mark packets as received. PSC outside 1..n_packets are ignored.
+        Input:
+            psc: int or array of int
+                The PSC of the received packets.
+        Output:
+            n_new: int
+                The number of packets which were not received before.
+        '''
+        psc = np.atleast_1d(np.asarray(psc, dtype=np.int64))
+        index = psc[(psc >= 1) & (psc <= self.n_packets)] - 1
+        index = np.unique(index[~self.received[index]])
+        self.received[index] = True
+        self.n_received += len(index)
+        return len(index)
+
+    def is_received(self, psc):
+        return 1 <= psc <= self.n_packets and bool(self.received[psc-1])
+
+    @property
+    def n_missing(self):
+        return self.n_packets - self.n_received
+
+    @property
+    def missing_rate(self):
+        '''
+        The percentage of missing packets, 100 for a file without packets.
+        '''
+        if self.n_packets == 0:
+            return 100
+        return (self.n_missing/self.n_packets)*100
+
+    def is_complete(self):
+        return self.n_packets > 0 and self.n_received == self.n_packets
+
+    def received_psc(self):
+        return np.flatnonzero(self.received) + 1
+
+    def missing_ranges(self):
+        '''
+        The missing packets as consecutive ranges.
+        Output:
+            ranges: ndarray (n_ranges, 2) int64
+                The first and last PSC of each missing range, in increasing order.
+        '''
+        missing = np.concatenate(([0], (~self.received).view(np.int8), [0]))
+        edges = np.diff(missing)
+        starts = np.flatnonzero(edges == 1) + 1
+        ends = np.flatnonzero(edges == -1)
+        return np.stack([starts, ends], axis=1)
@@ -4,10 +4,27 @@ OPT_EXTRA_HEADER = 28      # Optical receiver adds 28 bytes at the beginning
 OPT_EXTRA_TRAILER = 160    # ...and 160 bytes at the end of each packet
 TX_HEADER_SIZE = 28        # Transmitter header after sync marker (2+3+1+22 = 28 bytes)
 MAX_DATA_SIZE = 1087       # Payload size per packet
+TMP_RECORD_HEADER = 12     # Record header in ./tmp/ files: UNIX time (4) + PSC (3) + Type (1) + Length (4)
+FRAME_SIZE = OPT_EXTRA_HEADER + TX_HEADER_SIZE + MAX_DATA_SIZE + OPT_EXTRA_TRAILER # Bytes following each sync marker
 MAX_PACKET_NUMBER = 3e5    # Maximum number of packets in a file NEED TO BE CONFIRMED
 MISSINGRATE_TOLERANCE = 50 # Tolerance for missing rate, if the missing rate is larger than this value, request for whole file.
+STREAM_CHUNK_SIZE = 1 << 22 # Bytes read at once when streaming a capture
+FRAME_CRC = None           # CRC-16 of the frames (begin, end, offset): CRC of the bytes [begin, end) after the sync marker, stored at offset; None if the frames have no CRC NEED TO BE CONFIRMED
+UPLINK_BUDGET = 100        # Uplink commands which can be sent in one pass
+DOWNLINK_WINDOW = 10*16621 # Packets which can be downlinked in one pass
+TYPE_PRIORITY = {0: 1, 1: 4, 2: 1, 3: 2, 4: 2, 5: 1, 6: 1} # Priority of each file type (0 fits, 1 csv (HK), 2 mix, 3 txt, 4 log, 5 jpg, 6 H624)
+AGE_PRIORITY = 0.1         # Priority added per day since the file was taken
+FITS_WRITE_WORKERS = 0     # Threads writing the FITS files in the background, 0 to write them synchronously
+FITS_COMPRESSION = None    # Tile compression of the FITS images: None (uncompressed), 'RICE_1', 'GZIP_1' or 'GZIP_2'
+FITS_TILE_SHAPE = (16, 3008) # Tile shape (rows, columns) of the compressed FITS images
+INCREMENTAL_OUTPUT = False # Write the packets of incomplete files straight into ./Mission_data/<type>/<uid>.<type>.part
+METRICS_PORT = None        # Port of the local metrics endpoint http://localhost:<port>/metrics, None to disable
+UID_UTC_OFFSET = 9         # Time zone of the file UIDs YYYYMMDDhhmmss, hours from UTC (JST)
+MISSION_TYPES = ['fits', 'csv', 'mix', 'txt', 'log', 'jpg', 'H624'] # Folder and extension of each file type
 
 output_IM_folder_path = "./optical/"
 report_path = "./report/"
+report_db_path = "./report/report.db"
+METRICS_PATH = "./log/metrics.prom" # Prometheus text file of the pipeline metrics (see metrics.py)
 
 csv_header = 'Filename,Type,Start_Packet_number,End_Packet_number,Incompleteness\n'
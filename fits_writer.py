@@ -0,0 +1,135 @@
+import os
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from astropy.io import fits
+from constants import *
+from uid_codec import uid_datetime
+
+# Mission images are 3003x3008 uint16
+IMAGE_SHAPE = (3003, 3008)
+FITS_BLOCK = 2880
+
+# background writes, see write_fits and wait
+pool = None
+pending = []
+pending_lock = threading.Lock()
+
+def add_metadata(header, This_file):
+    '''
+    Add the metadata of the packets (file UID, type, length, number of packets, time of the UID) to a header.
+    '''
+    # placeholders of the header written by the previous version
+    header['header1'] = '1'
+    header['header2'] = '2'
+    header['header3'] = '3'
+    header['FILEUID'] = (This_file.Filename, 'file UID (YYYYMMDDhhmmss)')
+    header['FILETYPE'] = (This_file.Type, 'packet type indicator')
+    header['LENGTH'] = (This_file.Length, 'file length in bytes')
+    header['NPACKETS'] = (This_file.n_packets, 'number of packets')
+    try:
+        taken = uid_datetime(This_file.Filename)
+        header['DATE-OBS'] = (taken.strftime('%Y-%m-%dT%H:%M:%S'), 'UTC time of the file UID')
+    except ValueError:
+        pass
+    return header
+
+def make_header(This_file, shape=IMAGE_SHAPE):
+    '''
+    Build the FITS header of a mission image in memory, from the metadata of the packets.
+    Input:
+        This_file: FilePackets
+            The packets of the file (Filename, Type, Length).
+        shape: tuple
+            The image shape (NAXIS2, NAXIS1).
+    Output:
+        header: astropy.io.fits.Header
+            The primary header of an unsigned 16 bits image (BITPIX 16, BZERO 32768).
+    '''
+    header = fits.Header()
+    header['SIMPLE'] = True
+    header['BITPIX'] = 16
+    header['NAXIS'] = 2
+    header['NAXIS1'] = shape[1]
+    header['NAXIS2'] = shape[0]
+    header['EXTEND'] = True
+    header['BSCALE'] = 1
+    header['BZERO'] = 32768
+    return add_metadata(header, This_file)
+
+def write_image(file_path, header, image_data):
+    '''
+    Write a uint16 image as a FITS file, straight from the reassembly buffer.
+    The image is stored as big-endian int16 with BZERO 32768, i.e. each value XOR 0x8000,
+    computed in a single pass into the output buffer.
+    '''
+    out = np.empty(image_data.shape, dtype='>u2')
+    np.bitwise_xor(image_data, np.uint16(0x8000), out=out)
+    with open(file_path + '.part', 'wb') as f:
+        f.write(header.tostring().encode('ascii'))
+        f.write(out)
+        f.write(b'\0' * (-out.nbytes % FITS_BLOCK))
+    os.replace(file_path + '.part', file_path)
+
+def write_compressed(file_path, This_file, image_data, compression, tile_shape):
+    '''
+    Write a uint16 image as a tile-compressed FITS file (astropy CompImageHDU):
+    an empty primary HDU and the compressed image in extension 1, with the metadata in its header.
+    RICE_1 and GZIP are lossless for integer images.
+    '''
+    header = add_metadata(fits.Header(), This_file)
+    hdu = fits.CompImageHDU(image_data, header=header, compression_type=compression, tile_shape=tile_shape)
+    fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(file_path + '.part', overwrite=True, output_verify='silentfix')
+    os.replace(file_path + '.part', file_path)
+
+def write_fits(This_file, file_path, background=False, compression=None, tile_shape=None):
+    '''
+    Write a FITS mission image.
+    Input:
+        This_file: FilePackets
+            The complete file.
+        file_path: str
+            The output file.
+        background: bool
+            If True, the file is written by a thread of the pool (FITS_WRITE_WORKERS threads),
+            call wait to know whether the writes succeeded.
+        compression: str or None
+            None for an uncompressed primary image, else the tile compression ('RICE_1', 'GZIP_1', 'GZIP_2').
+            Defaults to FITS_COMPRESSION.
+        tile_shape: tuple or None
+            The tile shape of the compressed image, defaults to FITS_TILE_SHAPE.
+    '''
+    compression = compression or FITS_COMPRESSION
+    tile_shape = tile_shape or FITS_TILE_SHAPE
+    image_data = np.frombuffer(This_file.content(), dtype=np.uint16).reshape(IMAGE_SHAPE)
+    if compression:
+        write, args = write_compressed, (file_path, This_file, image_data, compression, tile_shape)
+    else:
+        write, args = write_image, (file_path, make_header(This_file), image_data)
+    if not background:
+        write(*args)
+        return
+    global pool
+    with pending_lock:
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=max(FITS_WRITE_WORKERS, 1))
+        pending.append((This_file.Filename, pool.submit(write, *args)))
+
+def wait():
+    '''
+    Wait for the background writes.
+    Output:
+        failed: list of int
+            The UID of the files which could not be written.
+    '''
+    with pending_lock:
+        writes = pending[:]
+        pending.clear()
+    failed = []
+    for Filename, future in writes:
+        try:
+            future.result()
+        except Exception as e:
+            print(f'Error writing the FITS file {Filename}: {e}')
+            failed.append(Filename)
+    return failed
@@ -0,0 +1,334 @@
+import os
+import time
+import numpy as np
+from constants import *
+from uid_codec import uids_from_unix
+import metrics
+
+# Byte offsets of the frame fields, counted from the first byte after the sync marker
+VCDU_OFFSET = OPT_EXTRA_HEADER
+SEQ_OFFSET = VCDU_OFFSET + 2
+MDPU_OFFSET = VCDU_OFFSET + 6
+PAYLOAD_OFFSET = VCDU_OFFSET + TX_HEADER_SIZE
+
+# A frame with its sync marker
+FRAME_STRIDE = len(SYNC_MARKER) + FRAME_SIZE
+LOCK_BATCH = 4096                   # frames checked at once while in lock, see scan_frames
+RESYNC_WINDOW = 64*FRAME_STRIDE     # bytes searched at once for a sync marker after a loss of lock
+
+# Record of the tmp files of the older format (before partial_store.py), written back to back
+TMP_RECORD = np.dtype([('sync', 'S4'), ('time', '>u4'), ('psc', 'u1', 3), ('type', 'u1'), ('length', '>u4'),
+                       ('payload', 'u1', MAX_DATA_SIZE)])
+
+def as_uint8(buf):
+    '''
+    View a bytes-like object as a flat uint8 array without copying it.
+    '''
+    if isinstance(buf, np.ndarray):
+        return buf.reshape(-1).view(np.uint8)
+    return np.frombuffer(buf, dtype=np.uint8)
+
+def map_file(file_path):
+    '''
+    Memory-map a capture read-only. Pages are loaded by the OS on access, so the
+    resident memory does not grow with the size of the capture.
+    Input:
+        file_path: str
+            The path of the file to map.
+    Output:
+        arr: uint8 ndarray (np.memmap, or an empty array for an empty file)
+    '''
+    if os.path.getsize(file_path) == 0:
+        return np.empty(0, dtype=np.uint8)
+    return np.memmap(file_path, dtype=np.uint8, mode='r')
+
+def find_sync_markers(buf):
+    '''
+    Locate every SYNC_MARKER in a buffer.
+    Input:
+        buf: bytes-like or uint8 ndarray
+            The raw capture.
+    Output:
+        markers: ndarray (int64)
+            The offset of the first byte of each sync marker, in increasing order.
+    '''
+    arr = as_uint8(buf)
+    n = len(arr) - len(SYNC_MARKER) + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    # check the first marker byte over the whole buffer, the others only on the candidates
+    markers = np.flatnonzero(arr[:n] == SYNC_MARKER[0])
+    for k in range(1, len(SYNC_MARKER)):
+        markers = markers[arr[markers + k] == SYNC_MARKER[k]]
+    return markers.astype(np.int64)
+
+def read_field(arr, positions, size):
+    '''
+    Read a big-endian unsigned integer of `size` bytes at every position at once.
+    '''
+    value = np.zeros(len(positions), dtype=np.int64)
+    for k in range(size):
+        value = (value << 8) | arr[positions + k]
+    return value
+
+def is_frame_start(arr, positions):
+    '''
+    True where a frame starts at the position: a sync marker followed by a VCDU header.
+    The frames must fit in the buffer (positions + FRAME_STRIDE <= len(arr)).
+    '''
+    ok = np.ones(len(positions), dtype=bool)
+    for k, byte in enumerate(SYNC_MARKER):
+        ok &= arr[positions + k] == byte
+    for k, byte in enumerate(VCDU_head):
+        ok &= arr[positions + len(SYNC_MARKER) + VCDU_OFFSET + k] == byte
+    return ok
+
+def next_frame_start(arr, begin):
+    '''
+    Search for the next frame from begin, RESYNC_WINDOW bytes at a time (acquisition or loss of lock).
+    Output:
+        start: int
+            The offset of the sync marker of the next complete frame, -1 if there is none.
+        end: int
+            If there is none, the offset from which the buffer may hold the beginning of a frame:
+            the first sync marker whose frame is not complete, else the last len(SYNC_MARKER)-1 bytes.
+    '''
+    n = len(arr)
+    first = begin
+    while begin < n:
+        end = min(begin + RESYNC_WINDOW, n)
+        markers = find_sync_markers(arr[begin:end + len(SYNC_MARKER) - 1]) + begin
+        complete = markers + FRAME_STRIDE <= n
+        valid = markers[complete][is_frame_start(arr, markers[complete])]
+        if len(valid) > 0:
+            return int(valid[0]), None
+        if not complete.all():
+            return -1, int(markers[~complete][0])
+        begin = end
+    return -1, max(n - (len(SYNC_MARKER) - 1), first)
+
+def scan_frames(buf, final=True):
+    '''
+    Locate the frames of a raw capture with a frame-aware scanner.
+
+    Once a frame is found (a sync marker followed by a VCDU header), the scanner is in lock:
+    the next frame must start FRAME_STRIDE bytes later, so it only checks the sync marker and VCDU header
+    there (LOCK_BATCH frames at a time) and never looks inside the frames, where a payload may contain
+    the bytes of SYNC_MARKER. When a frame is not where it is expected (loss of lock), the scanner searches
+    for the next frame from the sync marker of the last good frame: if that frame is found inside the last
+    frame, the last frame was truncated and is dropped.
+    Input:
+        buf: bytes-like or uint8 ndarray
+            The raw capture.
+        final: bool
+            False if more data will follow buf (a stream): the last frame is then left for the next read,
+            since it can not be checked against the frame after it.
+    Output:
+        markers: ndarray (int64)
+            The offset of the sync marker of each complete frame, in increasing order.
+        end: int
+            The offset of the first byte which was not scanned: the beginning of an incomplete frame
+            at the end of the buffer (or of the last frame if not final), or len(buf) - (len(SYNC_MARKER)-1) if none.
+        stats: dict
+            'frames' (frames found), 'locked' (frames found in lock, at FRAME_STRIDE from the previous one),
+            'lock_losses' (frames missing where they were expected), 'truncated' (frames dropped because
+            the next frame starts inside them) and 'skipped_bytes' (bytes before end outside the frames).
+    '''
+    arr = as_uint8(buf)
+    n = len(arr)
+    stats = {'frames': 0, 'locked': 0, 'lock_losses': 0, 'truncated': 0, 'skipped_bytes': 0}
+    runs = []
+    pos, end = next_frame_start(arr, 0)
+    while pos >= 0:
+        # in lock
+        run_start = pos
+        lost = False
+        while True:
+            count = min(LOCK_BATCH, (n - pos) // FRAME_STRIDE)
+            if count == 0:
+                break
+            ok = is_frame_start(arr, pos + FRAME_STRIDE*np.arange(count, dtype=np.int64))
+            k = count if ok.all() else int(np.argmin(ok))
+            pos += k*FRAME_STRIDE
+            if k < count:
+                lost = True
+                break
+        run = np.arange(run_start, pos, FRAME_STRIDE, dtype=np.int64)
+        if not lost:
+            # the end of the buffer, the next frame is not complete
+            if not final:
+                run = run[:-1]
+                pos -= FRAME_STRIDE
+            runs.append(run)
+            stats['locked'] += max(len(run) - 1, 0)
+            end = pos
+            break
+        # loss of lock, search from the inside of the last frame
+        stats['lock_losses'] += 1
+        pos, end = next_frame_start(arr, int(run[-1]) + len(SYNC_MARKER))
+        if 0 <= pos < run[-1] + FRAME_STRIDE:
+            run = run[:-1]
+            stats['truncated'] += 1
+        runs.append(run)
+        stats['locked'] += max(len(run) - 1, 0)
+
+    markers = np.concatenate(runs) if runs else np.empty(0, dtype=np.int64)
+    stats['frames'] = len(markers)
+    stats['skipped_bytes'] = int(end) - len(markers)*FRAME_STRIDE
+    return markers, int(end), stats
+
+def decode_frames(buf, markers=None):
+    '''
+    Decode every frame of a raw capture in one pass.
+
+    Each sync marker is followed by a fixed-size frame of FRAME_SIZE bytes:
+      [Optical Extra Header (28)] + [VCDU header (2) + sequence (3) + reserved (1) + MDPU header (22)] +
+      [payload (MAX_DATA_SIZE)] + [Optical Extra Trailer (160)]
+    The frames are located with scan_frames, so a sync marker inside a payload does not split a frame.
+    Frames which are truncated by the next frame or by the end of the buffer,
+    and frames without a valid VCDU header, are dropped.
+    The lock statistics of the scan are recorded in the metrics (see metrics.py).
+    Payloads are not copied: only their offsets in the buffer are returned.
+    Input:
+        buf: bytes-like or uint8 ndarray
+            The raw capture, e.g. from map_file.
+        markers: ndarray or None
+            The sync markers of the frames if buf was already scanned, see scan_frames.
+    Output:
+        frames: dict
+            Columns 'Filename' (file UID), 'Time' (UNIX time of the file), 'PSC', 'Type', 'Length'
+            and 'Offset' (offset of the payload in the buffer) as ndarray,
+            and 'buffer', the uint8 array the offsets refer to.
+    '''
+    arr = as_uint8(buf)
+    if markers is None:
+        markers, end, stats = scan_frames(arr)
+        record_scan(stats)
+    starts = markers + len(SYNC_MARKER)
+
+    unix_time = read_field(arr, starts + MDPU_OFFSET + 9, 4)
+
+    return {
+        'Filename': uids_from_unix(unix_time),
+        'Time': unix_time,
+        'PSC': read_field(arr, starts + SEQ_OFFSET, 3),
+        'Type': arr[starts + MDPU_OFFSET + 21].astype(np.int64),
+        'Length': read_field(arr, starts + MDPU_OFFSET + 17, 4),
+        'Offset': starts + PAYLOAD_OFFSET,
+        'buffer': arr,
+    }
+
+def record_scan(stats):
+    '''
+    Record the lock statistics of scan_frames in the metrics.
+    '''
+    for key in ('locked', 'lock_losses', 'truncated', 'skipped_bytes'):
+        metrics.inc(f'scan_{key}', stats[key])
+
+def payloads(frames, index=slice(None)):
+    '''
+    Gather the payloads of the selected frames into a (n, MAX_DATA_SIZE) uint8 array.
+    This is the only place where payload bytes are copied out of the capture.
+    The rows are gathered from a strided view of the buffer (one row per byte offset, no copy),
+    so no (n, MAX_DATA_SIZE) index array is built and the only allocation is the output.
+    '''
+    offsets = frames['Offset'][index]
+    if len(offsets) == 0:
+        return np.empty((0, MAX_DATA_SIZE), dtype=np.uint8)
+    return np.lib.stride_tricks.sliding_window_view(frames['buffer'], MAX_DATA_SIZE)[offsets]
+
+def payload_views(frames):
+    '''
+    Return the payload of every frame as a zero-copy memoryview into the capture.
+    '''
+    mv = memoryview(frames['buffer'])
+    return [mv[o:o + MAX_DATA_SIZE] for o in frames['Offset'].tolist()]
+
+def iter_frame_batches(stream, chunk_size=STREAM_CHUNK_SIZE, follow_timeout=0, poll=0.5):
+    '''
+    Decode a capture incrementally from a binary stream (file or pipe).
+    Only one chunk plus one incomplete frame is held in memory at a time; a sync marker
+    or frame straddling two reads is carried over to the next read (see scan_frames).
+    Input:
+        stream: binary file object
+            The capture, e.g. open(path, 'rb') or sys.stdin.buffer.
+        chunk_size: int
+            The number of bytes to read at once.
+        follow_timeout: float
+            If > 0, keep waiting for new data at the end of the stream until nothing was
+            appended for this many seconds (for a file which is still being written).
+        poll: float
+            The interval in seconds between two reads at the end of the stream when following.
+    Output:
+        generator of dict
+            The decoded frames of each chunk, see decode_frames.
+    '''
+    pending = b''
+    idle = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk and idle < follow_timeout:
+            time.sleep(poll)
+            idle += poll
+            continue
+        idle = 0
+        buf = pending + chunk
+        if not chunk:
+            # end of the stream, decode everything that is left
+            if buf:
+                yield decode_frames(buf)
+            return
+        
+        # keep the frame that is not fully read yet, or the bytes which may be the beginning of a sync marker
+        markers, cut, stats = scan_frames(buf, final=False)
+        record_scan(stats)
+        pending = buf[cut:]
+        if len(markers) > 0:
+            yield decode_frames(buf, markers)
+
+def decode_tmp_records(buf):
+    '''
+    Decode every record of a temporary file of the older format (before partial_store.py).
+    Each record is SYNC_MARKER + UNIX time (4) + PSC (3) + Type (1) + Length (4) + payload (MAX_DATA_SIZE),
+    the fixed-size TMP_RECORD. The records are read in one pass as an array of TMP_RECORD, so a sync marker
+    inside a payload cannot split a record. Only a file which is not a whole number of records, or whose
+    records do not all start with SYNC_MARKER (truncated or corrupted), is searched for sync markers.
+    Input:
+        buf: bytes-like or uint8 ndarray
+            The content of the temporary file, e.g. from map_file.
+    Output:
+        frames: dict
+            Same columns as decode_frames.
+    '''
+    arr = as_uint8(buf)
+    if len(arr) % TMP_RECORD.itemsize == 0:
+        records = arr.view(TMP_RECORD)
+        if np.all(records['sync'] == SYNC_MARKER):
+            psc = records['psc'].astype(np.int64)
+            unix_time = records['time'].astype(np.int64)
+            return {
+                'Filename': uids_from_unix(unix_time),
+                'Time': unix_time,
+                'PSC': (psc[:, 0] << 16) | (psc[:, 1] << 8) | psc[:, 2],
+                'Type': records['type'].astype(np.int64),
+                'Length': records['length'].astype(np.int64),
+                'Offset': np.arange(len(records), dtype=np.int64)*TMP_RECORD.itemsize + len(SYNC_MARKER) + TMP_RECORD_HEADER,
+                'buffer': arr,
+            }
+
+    markers = find_sync_markers(arr)
+    starts = markers + len(SYNC_MARKER)
+    ends = np.append(markers[1:], len(arr))
+    starts = starts[ends - starts >= TMP_RECORD_HEADER + MAX_DATA_SIZE]
+
+    unix_time = read_field(arr, starts, 4)
+
+    return {
+        'Filename': uids_from_unix(unix_time),
+        'Time': unix_time,
+        'PSC': read_field(arr, starts + 4, 3),
+        'Type': arr[starts + 7].astype(np.int64),
+        'Length': read_field(arr, starts + 8, 4),
+        'Offset': starts + TMP_RECORD_HEADER,
+        'buffer': arr,
+    }
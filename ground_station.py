@@ -0,0 +1,266 @@
+import time
+import datetime
+import os
+import glob
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# The stages are imported once and called in this process,
+# instead of starting a new python3 (and re-importing numpy/pandas/astropy) for every file.
+import check_data
+import combine
+import read_bin
+import cmd_gen
+import metrics
+from constants import report_path, MISSION_TYPES, METRICS_PORT
+from utility import write_reports
+from report_store import ReportStore
+from watcher import make_watcher, list_files, is_temporary
+
+# Check for new files every x seconds
+check_time = 5
+
+raw_data_folder = "./raw_data/"
+req_data_folder = "./requested_data/"
+img_data_folder = "./optical/"
+log_folder = "./log/"
+archive_raw_folder = "./archive/raw_data/"
+archive_req_folder = "./archive/requested_data/"
+
+# the reports (un_gen, final_check, report) are kept in ./report/report.db,
+# ./report/*.csv are exported from it at the end of every cycle
+store = None
+
+class StageError(Exception):
+    '''
+    A stage failed, the in-process equivalent of subprocess.CalledProcessError.
+    '''
+
+def run_stage(stage, *args):
+    '''
+    Call a stage (e.g. check_data.main) in this process with the semantics of running it as a script:
+    sys.exit with a non-zero status or an uncaught exception is a failure.
+    Input:
+        stage: callable
+            The main function of the stage.
+        args:
+            The arguments, as they would be given on the command line.
+    Output:
+        Raises StageError if the stage failed.
+    '''
+    name = f'{stage.__module__}.{stage.__name__}'
+    try:
+        with metrics.timer('stage', stage=name):
+            stage(*args)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            metrics.inc('stage_failures', stage=name)
+            raise StageError(f'{name} exited with status {e.code}') from e
+    except Exception as e:
+        metrics.inc('stage_failures', stage=name)
+        raise StageError(f'{name} failed: {e}') from e
+
+def call_stage(stage, *args):
+    '''
+    Call a check stage (check_data.check or combine.combine) and return its result.
+    This is also the function run by the worker processes, so a failure is returned as a status, never raised.
+    Output:
+        result: tuple
+            report_incpl, report_cpl, status
+        collected: dict
+            The metrics recorded by the stage (see metrics.collect), to be merged in the main process.
+    '''
+    name = f'{stage.__module__}.{stage.__name__}'
+    with metrics.collect() as collected:
+        with metrics.timer('stage', stage=name):
+            try:
+                result = stage(*args)
+            except SystemExit as e:
+                result = [], [], e.code
+            except Exception as e:
+                print(f'{name} failed: {e}')
+                result = [], [], 1
+        if result[2] not in (None, 0):
+            metrics.inc('stage_failures', stage=name)
+    return result, collected
+
+def map_stage(stage, paths, pool=None):
+    '''
+    Yield the results of call_stage(stage, path) for each path, in the order of paths.
+    With a pool, all the paths are submitted at once and checked concurrently,
+    and the metrics of the workers are merged into the metrics of this process.
+    '''
+    if pool is None:
+        for path in paths:
+            yield call_stage(stage, path)[0]
+    else:
+        futures = [pool.submit(call_stage, stage, path) for path in paths]
+        for future in futures:
+            result, collected = future.result()
+            metrics.merge(collected)
+            yield result
+
+def finish_stage(stage, result):
+    '''
+    Write the reports of a check stage, then raise StageError if it failed.
+    Only the main process writes the reports, so they are never written concurrently.
+    '''
+    report_incpl, report_cpl, status = result
+    write_reports(report_incpl, report_cpl, store)
+    if status not in (None, 0):
+        raise StageError(f'{stage.__module__}.{stage.__name__} exited with status {status}')
+
+def log(log_file, message):
+    with open(log_file, "a") as f:
+        f.write(message)
+
+def new_log_file():
+    time_now = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    nfiles = len(glob.glob(log_folder + "*.log"))
+    log_file = log_folder + f"log_{nfiles}_{time_now}.log"
+    open(log_file, 'a').close()
+    return log_file
+
+def process_raw_files(files, log_file, pool=None):
+    processed = set()
+    files = sorted(files)  # Process in order
+    for file in files:
+        log(log_file, f"Checking {file}\n")
+    paths = [os.path.join(raw_data_folder, file) for file in files]
+    for file, file_path, result in zip(files, paths, map_stage(check_data.check, paths, pool)):
+        try:
+            finish_stage(check_data.check, result)
+            log(log_file, f"Finish checking {file}\n")
+            processed.add(file)
+        except StageError as e:
+            log(log_file, f"Error for checking {file_path}: {e}\nDelete {file}, request again.\n")
+            os.remove(file_path)
+    return processed
+
+def process_req_files(files, log_file, pool=None):
+    processed = set()
+    files = sorted(files)  # Process in order
+    for file in files:
+        log(log_file, f"Extract packets from {file}\n")
+    paths = [os.path.join(req_data_folder, file) for file in files]
+    for file, file_path, result in zip(files, paths, map_stage(combine.combine, paths, pool)):
+        try:
+            finish_stage(combine.combine, result)
+            log(log_file, f"Finished extracting {file}\n")
+            processed.add(file)
+        except StageError as e:
+            log(log_file, f"Error for extracting {file_path}: {e}\nDelete {file}.\n")
+            os.remove(file_path)
+    return processed
+
+def process_img_file(file, log_file):
+    # file = opt_frame_n_Fxxx.bin
+    file_path = os.path.join(img_data_folder, file)
+    file_originame = file.split('_')[-1] # Fxxx.bin
+    log(log_file, f"Reading {file}\n")
+    try:
+        run_stage(read_bin.main, file_path)
+        log(log_file, f"Finished compiling image from {file}\n")
+        store.confirm(file_originame, failed=False)
+        return True
+    except StageError as e:
+        # file failed to compile, corrupted file, request again
+        log(log_file, f"Error for reading {file_path}: {e}\nDelete {file}, request again.\n")
+        store.confirm(file_originame, failed=True)
+        os.remove(file_path)
+        return False
+
+def archive(log_file, processed_raw_files, processed_req_files, processed_img_files):
+    # clear the processed files
+    for file in processed_raw_files:
+        log(log_file, f"Move {file} to archive\n")
+        os.replace(f'{raw_data_folder}{file}', f'{archive_raw_folder}{file}')
+    for file in processed_req_files:
+        log(log_file, f"Move {file} to archive\n")
+        os.replace(f'{req_data_folder}{file}', f'{archive_req_folder}{file}')
+    for file in processed_img_files:
+        log(log_file, f"Delete {file}\n")
+        os.remove(f'{img_data_folder}{file}')
+
+def setup():
+    for folder in [log_folder, raw_data_folder, req_data_folder, img_data_folder, './report/', './tmp/',
+                   './cmd/', './cmd/list/', archive_raw_folder, archive_req_folder]:
+        os.makedirs(folder, exist_ok=True)
+    for Type in MISSION_TYPES:
+        os.makedirs(f'./Mission_data/{Type}/', exist_ok=True)
+
+def main(watch=False, workers=1, metrics_port=METRICS_PORT):
+    '''
+    Run the ground station loop.
+    Input:
+        watch: bool
+            If False, list the data folders every check_time seconds.
+            If True, wait for files to be closed after writing or renamed into the folders
+            (inotify, or polling for a stable size where inotify is not available), and start
+            processing as soon as a file lands. cmd_gen still runs every check_time seconds, and at most
+            once every check_time seconds however many files land (each run writes a new command list).
+        workers: int
+            The number of worker processes checking raw and requested files concurrently.
+            The reports are still written by this process only, and the tmp files are locked while updated.
+        metrics_port: int or None
+            If set, the metrics are also served on http://localhost:<metrics_port>/metrics.
+            They are written to METRICS_PATH at the end of every cycle (see metrics.py).
+    '''
+
+    global store
+
+    setup()
+    store = ReportStore()
+    log_file = new_log_file()
+    metrics.serve(metrics_port)
+    folders = [raw_data_folder, req_data_folder, img_data_folder]
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    if watch:
+        watcher = make_watcher(folders)
+        # the files which are already there when the station starts
+        ready = {folder: {f for f in list_files(folder) if not is_temporary(f)} for folder in folders}
+    last_cmd_gen = None
+
+    while True:
+
+        if os.path.getsize(log_file) > 1e7: # size limit of a report file is ~ 10MB
+            print('The last log file is too large, create a new one.')
+            log_file = new_log_file()
+
+        if not watch:
+            ready = {folder: list_files(folder) for folder in folders}
+
+        cycle_start = time.perf_counter()
+        processed_raw_files = process_raw_files(ready[raw_data_folder], log_file, pool)
+        processed_req_files = process_req_files(ready[req_data_folder], log_file, pool)
+        processed_img_files = {f for f in sorted(ready[img_data_folder]) if process_img_file(f, log_file)}
+
+        # in watch mode a cycle runs for every file event, but cmd_gen writes a new command list folder
+        # (named after the current second) every time it runs, so it runs at most once every check_time seconds
+        if last_cmd_gen is None or time.monotonic() - last_cmd_gen >= check_time:
+            last_cmd_gen = time.monotonic()
+            try:
+                run_stage(cmd_gen.main)
+            except StageError as e:
+                log(log_file, f"Error for generating commands: {e}\n")
+        with metrics.timer('report_export'):
+            store.export_csv(report_path)
+        metrics.observe('cycle', time.perf_counter() - cycle_start)
+        metrics.write_textfile()
+
+        if watch:
+            archive(log_file, processed_raw_files, processed_req_files, processed_img_files)
+            # wake up when cmd_gen is due at the latest, to request the packets of a burst of files once it is over
+            ready = watcher.wait(max(last_cmd_gen + check_time - time.monotonic(), 0))
+        else:
+            time.sleep(check_time)
+            archive(log_file, processed_raw_files, processed_req_files, processed_img_files)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='VERTECS X-band ground station')
+    parser.add_argument('--watch', action='store_true', help='process files as soon as they are written')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes checking files')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT, help='serve the metrics on this local port')
+    args = parser.parse_args()
+    main(watch=args.watch, workers=args.workers, metrics_port=args.metrics_port)
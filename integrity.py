@@ -0,0 +1,115 @@
+import numpy as np
+from constants import *
+from frames import PAYLOAD_OFFSET
+import metrics
+
+# Integrity checks of the decoded frames (see frames.decode_frames), done for all the frames of a capture at once.
+# The frames which fail are dropped before reassembly, so their packets are reported as missing
+# and requested again as a segment, instead of corrupting the file and costing a full-file request.
+
+def make_crc16_table(poly=0x1021):
+    table = np.zeros(256, dtype=np.uint32)
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) if crc & 0x8000 else (crc << 1)
+        table[byte] = crc & 0xFFFF
+    return table
+
+CRC16_TABLE = make_crc16_table()
+CRC_BATCH = 8192 # frames checked at once, bounds the memory of the gathered bytes
+
+def crc16_frames(arr, starts, begin, end):
+    '''
+    The CRC-16/CCITT (polynomial 0x1021, initial value 0xFFFF, the CCSDS frame error control field)
+    of the bytes [begin, end) of every frame, computed for all the frames at once.
+    Input:
+        arr: uint8 ndarray
+            The capture.
+        starts: ndarray of int
+            The offset of the first byte after the sync marker of each frame.
+        begin, end: int
+            The bytes covered by the CRC, counted from the first byte after the sync marker.
+    Output:
+        crc: ndarray (len(starts),) uint32
+    '''
+    crc = np.full(len(starts), 0xFFFF, dtype=np.uint32)
+    if len(starts) == 0 or end <= begin:
+        return crc
+    # the covered bytes of each frame, gathered from a strided view (no index array)
+    window = np.lib.stride_tricks.sliding_window_view(arr, end - begin)
+    for first in range(0, len(starts), CRC_BATCH):
+        block = window[starts[first:first+CRC_BATCH] + begin]
+        value = crc[first:first+CRC_BATCH]
+        for k in range(end - begin):
+            value = ((value << 8) & 0xFFFF) ^ CRC16_TABLE[((value >> 8) ^ block[:, k]) & 0xFF]
+        crc[first:first+CRC_BATCH] = value
+    return crc
+
+def check_frames(frames, crc=FRAME_CRC):
+    '''
+    Check the integrity of decoded frames.
+      - crc: if the frames carry a CRC-16 (FRAME_CRC = (begin, end, offset)), it must match the bytes [begin, end).
+      - header: every frame of a file must have the Type and Length of the majority of the frames of that file.
+      - psc: the PSC must be within 1..number of packets of the file.
+    Input:
+        frames: dict
+            The output of frames.decode_frames.
+        crc: tuple or None
+            (begin, end, offset) of the CRC, counted from the first byte after the sync marker, None if there is no CRC.
+    Output:
+        good: ndarray of bool
+            True for the frames which passed every check.
+        n_bad: dict
+            The number of frames which failed each check ('crc', 'header', 'psc').
+    '''
+    n = len(frames['PSC'])
+    good = np.ones(n, dtype=bool)
+    n_bad = {'crc': 0, 'header': 0, 'psc': 0}
+    if n == 0:
+        return good, n_bad
+
+    if crc is not None:
+        begin, end, offset = crc
+        arr = frames['buffer']
+        starts = frames['Offset'] - PAYLOAD_OFFSET
+        stored = (arr[starts + offset].astype(np.uint32) << 8) | arr[starts + offset + 1]
+        good &= crc16_frames(arr, starts, begin, end) == stored
+        n_bad['crc'] = int(np.count_nonzero(~good))
+
+    # the most frequent (Type, Length) of each file, among the frames with a good CRC
+    index = np.flatnonzero(good)
+    headers = np.stack([frames['Filename'][index], frames['Type'][index], frames['Length'][index]], axis=1)
+    combos, inverse, counts = np.unique(headers, axis=0, return_inverse=True, return_counts=True)
+    order = np.lexsort((-counts, combos[:, 0]))
+    majority = np.zeros(len(combos), dtype=bool)
+    majority[order[np.r_[True, combos[order[1:], 0] != combos[order[:-1], 0]]]] = True
+    header_ok = majority[inverse.reshape(-1)]
+    good[index[~header_ok]] = False
+    n_bad['header'] = int(np.count_nonzero(~header_ok))
+
+    n_packets = -(-frames['Length'] // MAX_DATA_SIZE)
+    psc_ok = (frames['PSC'] >= 1) & (frames['PSC'] <= n_packets)
+    n_bad['psc'] = int(np.count_nonzero(good & ~psc_ok))
+    good &= psc_ok
+    return good, n_bad
+
+def select_frames(frames, index):
+    '''
+    The frames selected by a boolean mask or an index array, with the same buffer.
+    '''
+    return {key: (value if key == 'buffer' else value[index]) for key, value in frames.items()}
+
+def verify_frames(frames, crc=FRAME_CRC):
+    '''
+    Drop the frames which fail check_frames, print and count (metrics frames_dropped) how many failed.
+    '''
+    good, n_bad = check_frames(frames, crc)
+    for check, n in n_bad.items():
+        if n:
+            metrics.inc('frames_dropped', n, check=check)
+    if good.all():
+        return frames
+    print(f'Integrity check: {len(good) - np.count_nonzero(good)} bad frames dropped '
+          f'(crc {n_bad["crc"]}, header {n_bad["header"]}, psc {n_bad["psc"]})')
+    return select_frames(frames, good)
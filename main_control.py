@@ -5,6 +5,8 @@ import subprocess
 import glob
 import sys
 
+from report_store import ReportStore
+
 # import numpy as np
 # import pandas as pd
 # import binascii
@@ -47,14 +49,9 @@ nfiles = len(glob.glob(log_folder + "*.log"))
 log_file = log_folder + f"log_{nfiles}_{time_now}.log"
 subprocess.run(['touch', log_file])
 
-cmd_gen_files = './report/un_gen.csv'
-check_file = './report/final_check.csv'
-final_report = './report/report.csv'
-if os.path.exists(final_report):
-    pass
-else:
-    with open(final_report, 'w') as f:
-        f.write(csv_header)
+# the reports (un_gen, final_check, report) are kept in ./report/report.db, ./report/*.csv are exported from it
+with ReportStore() as store:
+    store.export_csv()
 
 while True:
     # print_memory()
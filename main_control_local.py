@@ -5,6 +5,8 @@ import subprocess
 import glob
 import sys
 
+from report_store import ReportStore
+
 # import numpy as np
 # import pandas as pd
 # import binascii
@@ -47,14 +49,9 @@ nfiles = len(glob.glob(log_folder + "*.log"))
 log_file = log_folder + f"log_{nfiles}_{time_now}.log"
 subprocess.run(['touch', log_file])
 
-cmd_gen_files = './report/un_gen.csv'
-check_file = './report/final_check.csv'
-final_report = './report/report.csv'
-if os.path.exists(final_report):
-    pass
-else:
-    with open(final_report, 'w') as f:
-        f.write(csv_header)
+# the reports (un_gen, final_check, report) are kept in ./report/report.db, ./report/*.csv are exported from it
+with ReportStore() as store:
+    store.export_csv()
 
 while True:
     # print_memory()
@@ -129,49 +126,18 @@ while True:
             with open(log_file, "a") as f:
                 f.write(f"Finished compiling image from {file}\n")
             processed_img_files.add(file)
-            # Read the report of file_originame from check_file and append it to final_report
-            with open(check_file, 'r') as f1:
-                lines = f1.readlines()[1:]  # Skip the header
-            with open(final_report, 'a') as f2:
-                new_lines = []
-                for line in lines:
-                    if line.split(',')[0] == file_originame:
-                        f2.write(line)  # Append to final_report
-                    else:
-                        new_lines.append(line)  # Keep other lines (original lines in check_file)
-                
-            # Overwrite check_file with remaining lines
-            with open(check_file, 'w') as f:
-                f.write(csv_header)  # Write header
-                f.writelines(new_lines)
-                
-            # report the completed file to cmd_gen_files. Final confirmation.
-            with open(cmd_gen_files, 'a') as f3:
-                f3.write(f'{file_originame},OK,0,0,0\n')
+            # move the report of file_originame from final_check to report, and confirm it to un_gen. Final confirmation.
+            with ReportStore() as store:
+                store.confirm(file_originame, failed=False)
+                store.export_csv()
             
-        # file failed to compile. Copy report from check_file to final_report
+        # file failed to compile. corrupted file, request again
         except subprocess.CalledProcessError as e:
             with open(log_file, "a") as f:
                 f.write(f"Error for reading {file_path}: {e}\n")
-            # corrupted file, request again
-            with open(check_file, 'r') as f1:
-                lines = f1.readlines()
-            with open(final_report, 'a') as f2:
-                new_lines = []
-                for line in lines:
-                    if line.split(',')[0] == file.split('_')[-1]:
-                        f2.write(f'{file},Error,65535,65535,100\n')  # Append to report.csv
-                    else:
-                        new_lines.append(line)  # Keep other lines (original lines in check_file)
-            
-            # Overwrite check_file with remaining lines
-            with open(check_file, 'w') as f:
-                f.write(csv_header)  # Write header
-                f.writelines(new_lines)
-                
-            # report the corrupted file to cmd_gen_files. 
-            with open(cmd_gen_files, 'a') as f3:
-                f3.write(f'{file_originame},Error,65535,65535,100\n')
+            with ReportStore() as store:
+                store.confirm(file_originame, failed=True)
+                store.export_csv()
             
             with open(log_file, "a") as f:
                 f.write(f"Delete {file}, request again.\n")
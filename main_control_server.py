@@ -5,6 +5,8 @@ import subprocess
 import glob
 import sys
 
+from report_store import ReportStore
+
 # import numpy as np
 # import pandas as pd
 # import binascii
@@ -45,12 +47,12 @@ log_file = log_folder + f"log_{nfiles}_{time_now}.log"
 subprocess.run(['touch', log_file])
 
 
-fout_name_cpl = './report/final_check.csv'
-with open(fout_name_cpl, 'w') as f:
-    f.write('Filename,Type,Start_Packet_number,End_Packet_number,Incompleteness(100*missing/16621)\n')
-final_report = './report/report.csv'
-with open(final_report, 'w') as f:
-    f.write('Filename,Type,Start_Packet_number,End_Packet_number,Incompleteness(100*missing/16621)\n')
+# the reports are kept in ./report/report.db, ./report/*.csv are exported from it
+# final_check and report start empty, Incompleteness = 100*missing/16621
+with ReportStore() as store:
+    store.clear('final_check')
+    store.clear('report')
+    store.export_csv()
 
 while True:
     
@@ -132,38 +134,18 @@ while True:
             with open(log_file, "a") as f:
                 f.write(f"Finished compiling image from {file}\n")
             processed_img_files.add(file)
-            # complete file, cut the report in final_check.csv to report.csv
-            with open('./report/final_check.csv', 'r') as f1:
-                lines = f1.readlines()
-            # Open report.csv to append the matched line
-            with open('./report/report.csv', 'a') as f2:
-                new_lines = []
-                for line in lines:
-                    if line.split(',')[0] == file.split('_')[-1]:
-                        f2.write(line)  # Append to report.csv
-                    else:
-                        new_lines.append(line)  # Keep other lines
-            # Overwrite final_check.csv with remaining lines
-            with open('./report/final_check.csv', 'w') as f1:
-                f1.writelines(new_lines)
+            # complete file, move its report from final_check to report
+            with ReportStore() as store:
+                store.confirm(file.split('_')[-1], failed=False, request=False)
+                store.export_csv()
                 
         except subprocess.CalledProcessError as e:
             with open(log_file, "a") as f:
                 f.write(f"Error for reading {file_path}: {e}\n")
             # incomplete file, request again
-            with open('./report/final_check.csv', 'r') as f1:
-                lines = f1.readlines()
-            # Open report.csv to append the matched line
-            with open('./report/report.csv', 'a') as f2:
-                new_lines = []
-                for line in lines:
-                    if line.split(',')[0] == file.split('_')[-1]:
-                        f2.write(f'{file},Error,65535,65535,100\n')  # Append to report.csv
-                    else:
-                        new_lines.append(line)  # Keep other lines
-            # Overwrite final_check.csv with remaining lines
-            with open('./report/final_check.csv', 'w') as f1:
-                f1.writelines(new_lines)
+            with ReportStore() as store:
+                store.confirm(file.split('_')[-1], failed=True, request=False)
+                store.export_csv()
             
             with open(log_file, "a") as f:
                 f.write(f"Delete {file}, request again.\n")
@@ -0,0 +1,215 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from constants import *
+
+# Counters and timers of the pipeline, exposed in the Prometheus text format:
+# written to METRICS_PATH at the end of every ground station cycle (node_exporter textfile collector),
+# and served on http://localhost:METRICS_PORT/metrics if METRICS_PORT is set.
+#   counters: <name> (labels) incremented with inc
+#   timers:   <name>_seconds_sum, <name>_seconds_count and <name>_last_seconds, updated with observe or timer
+#   gauges:   <name>, set with set_gauge
+# The worker processes of ground_station collect their own metrics (see collect) and send them back with the reports.
+
+PREFIX = 'xband_'
+
+HELP = {
+    'frames_decoded': 'frames decoded from captures',
+    'bytes_decoded': 'bytes of captures decoded',
+    'frames_dropped': 'frames dropped by the integrity checks',
+    'decode': 'time to decode and check the frames of a capture',
+    'decode_frames_per_second': 'frames decoded per second, last capture',
+    'decode_bytes_per_second': 'bytes decoded per second, last capture',
+    'scan_locked': 'frames found in lock by the frame scanner',
+    'scan_lock_losses': 'frames missing where the frame scanner expected them',
+    'scan_truncated': 'frames dropped because the next frame starts inside them',
+    'scan_skipped_bytes': 'bytes of captures outside the frames',
+    'files_checked': 'files checked, by result',
+    'packets_missing': 'packets missing in the files checked',
+    'packets_duplicate': 'copies of received packets with the same payload (dedup hits)',
+    'packets_conflict': 'copies of received packets with another payload',
+    'packets_written': 'new packets written to the tmp files',
+    'compile': 'time to compile the complete files',
+    'report_write': 'time to write the report rows',
+    'report_export': 'time to export the CSV reports',
+    'stage': 'wall time of the stages',
+    'stage_failures': 'stages which failed',
+    'cycle': 'wall time of a ground station cycle',
+}
+
+lock = threading.Lock()
+counters = {}  # (name, labels) -> value
+timers = {}    # (name, labels) -> [sum, count, last]
+gauges = {}    # (name, labels) -> value
+server = None
+
+def label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name, value=1, **labels):
+    '''
+    Add value to a counter.
+    '''
+    key = (name, label_key(labels))
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    '''
+    Record a duration in a timer.
+    '''
+    key = (name, label_key(labels))
+    with lock:
+        timer = timers.setdefault(key, [0.0, 0, 0.0])
+        timer[0] += seconds
+        timer[1] += 1
+        timer[2] = seconds
+
+def set_gauge(name, value, **labels):
+    with lock:
+        gauges[(name, label_key(labels))] = value
+
+@contextmanager
+def timer(name, **labels):
+    '''
+    Time a block: with timer('compile'): ...
+    The duration is recorded even if the block raises.
+    '''
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+def record_decode(n_frames, n_bytes, seconds):
+    '''
+    Record the decoding of a capture: frames, bytes and throughput.
+    '''
+    inc('frames_decoded', n_frames)
+    inc('bytes_decoded', n_bytes)
+    observe('decode', seconds)
+    if seconds > 0:
+        set_gauge('decode_frames_per_second', n_frames/seconds)
+        set_gauge('decode_bytes_per_second', n_bytes/seconds)
+
+def snapshot():
+    '''
+    A copy of every metric, which can be pickled and merged into another process with merge.
+    '''
+    with lock:
+        return {'counters': dict(counters), 'timers': {k: list(v) for k, v in timers.items()}, 'gauges': dict(gauges)}
+
+def merge(other):
+    '''
+    Add a snapshot to the metrics of this process: counters and timers are summed, gauges are replaced.
+    '''
+    with lock:
+        for key, value in other['counters'].items():
+            counters[key] = counters.get(key, 0) + value
+        for key, (total, count, last) in other['timers'].items():
+            timer = timers.setdefault(key, [0.0, 0, 0.0])
+            timer[0] += total
+            timer[1] += count
+            timer[2] = last
+        gauges.update(other['gauges'])
+
+def reset():
+    with lock:
+        counters.clear()
+        timers.clear()
+        gauges.clear()
+
+@contextmanager
+def collect():
+    '''
+    Collect the metrics of a block separately: the metrics recorded in the block are yielded as a snapshot
+    (filled when the block exits) and merged back into the metrics of this process.
+    In a worker process, the snapshot is what is sent back to the main process.
+    '''
+    global counters, timers, gauges
+    with lock:
+        saved = counters, timers, gauges
+        counters, timers, gauges = {}, {}, {}
+    collected = {}
+    try:
+        yield collected
+    finally:
+        collected.update(snapshot())
+        with lock:
+            counters, timers, gauges = saved
+        merge(collected)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+def render():
+    '''
+    The metrics in the Prometheus text exposition format.
+    '''
+    data = snapshot()
+    lines = []
+    def family(name, full, kind, samples, note=''):
+        if name in HELP:
+            lines.append(f'# HELP {full} {HELP[name]}{note}')
+        lines.append(f'# TYPE {full} {kind}')
+        lines.extend(samples)
+
+    for kind, suffix, metrics in (('counter', '_total', data['counters']), ('gauge', '', data['gauges'])):
+        for name in sorted({name for name, _ in metrics}):
+            full = PREFIX + name + suffix
+            family(name, full, kind, [f'{full}{format_labels(labels)} {value}'
+                                      for (n, labels), value in sorted(metrics.items()) if n == name])
+    for name in sorted({name for name, _ in data['timers']}):
+        full = PREFIX + name + '_seconds'
+        samples, last_samples = [], []
+        for (n, labels), (total, count, last) in sorted(data['timers'].items()):
+            if n == name:
+                samples += [f'{full}_sum{format_labels(labels)} {total:.6f}',
+                            f'{full}_count{format_labels(labels)} {count}']
+                last_samples.append(f'{PREFIX}{name}_last_seconds{format_labels(labels)} {last:.6f}')
+        family(name, full, 'summary', samples)
+        family(name, f'{PREFIX}{name}_last_seconds', 'gauge', last_samples, ', last')
+    return '\n'.join(lines) + '\n'
+
+def write_textfile(path=None):
+    '''
+    Write the metrics to a file (METRICS_PATH by default), replaced atomically so it is never read half-written.
+    '''
+    path = path or METRICS_PATH
+    if not path:
+        return
+    with open(path + '.part', 'w') as f:
+        f.write(render())
+    os.replace(path + '.part', path)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve(port=None, host='127.0.0.1'):
+    '''
+    Serve the metrics on http://host:port/metrics from a daemon thread (METRICS_PORT by default).
+    '''
+    global server
+    port = port or METRICS_PORT
+    if not port or server is not None:
+        return server
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
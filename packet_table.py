@@ -0,0 +1,238 @@
+import zlib
+import numpy as np
+from constants import *
+from frames import payloads
+from completeness import Completeness
+
+def packet_count(length):
+    '''
+    Number of packets of MAX_DATA_SIZE bytes needed for a file of `length` bytes.
+    '''
+    return -(-int(length) // MAX_DATA_SIZE)
+
+def payload_crc(data):
+    '''
+    The CRC32 (zlib) of each payload.
+    Input:
+        data: ndarray (n, MAX_DATA_SIZE) uint8
+    Output:
+        crc: ndarray (n,) uint32
+    '''
+    return np.fromiter((zlib.crc32(row) for row in np.ascontiguousarray(data)), dtype=np.uint32, count=len(data))
+
+class FilePackets:
+    '''
+    The packets received for one file, stored at their PSC in a preallocated buffer.
+    Attributes:
+        Filename: int
+            The file UID (YYYYMMDDhhmmss).
+        Type: int
+            The packet type indicator of the file.
+        Length: int
+            The actual file length in bytes.
+        n_packets: int
+            The number of packets of the file, 0 if Length is 0 or larger than MAX_PACKET_NUMBER packets.
+        data: ndarray (n_packets, MAX_DATA_SIZE) uint8
+            The payload of PSC p is data[p-1].
+        completeness: Completeness
+            The packets received so far.
+        crc: ndarray (n_packets,) uint32
+            The CRC32 of each received payload.
+        n_duplicates: int
+            The number of copies of received packets with the same payload, which were dropped.
+        conflict_psc: set of int
+            The PSC of the packets received again with another payload. The first copy is kept.
+    '''
+
+    def __init__(self, Filename, Type, Length):
+        self.Filename = int(Filename)
+        self.Type = int(Type)
+        self.Length = int(Length)
+        self.n_packets = packet_count(Length)
+        if self.n_packets > MAX_PACKET_NUMBER:
+            # corrupted header, do not allocate anything
+            self.n_packets = 0
+        self.data = np.zeros((self.n_packets, MAX_DATA_SIZE), dtype=np.uint8)
+        self.completeness = Completeness(self.n_packets)
+        self.crc = np.zeros(self.n_packets, dtype=np.uint32)
+        self.n_duplicates = 0
+        self.conflict_psc = set()
+
+    def __len__(self):
+        return self.completeness.n_received
+
+    @property
+    def present(self):
+        return self.completeness.received
+
+    def insert(self, psc, payload):
+        '''
+        Store the payload of one packet. Packets outside 1..n_packets are ignored.
+        A packet which is already present is kept, the copy is counted as a duplicate or a conflict.
+        Output:
+            stored: bool
+        '''
+        if not 1 <= psc <= self.n_packets:
+            return False
+        payload = np.frombuffer(payload, dtype=np.uint8, count=MAX_DATA_SIZE)
+        crc = zlib.crc32(payload)
+        if self.completeness.is_received(psc):
+            self.record_copies(np.array([psc]), np.array([crc == self.crc[psc-1]]))
+            return False
+        self.data[psc-1] = payload
+        self.crc[psc-1] = crc
+        self.completeness.mark_received(psc)
+        return True
+
+    def record_copies(self, psc, same):
+        '''
+        Count the copies of packets which are already present.
+        Input:
+            psc: ndarray of int
+                The PSC of the copies.
+            same: ndarray of bool
+                True if the copy has the payload CRC of the stored packet (a duplicate), else it is a conflict.
+        '''
+        self.n_duplicates += int(np.count_nonzero(same))
+        self.conflict_psc.update(psc[~same].tolist())
+
+    def insert_many(self, psc, data, overwrite=True, crc=None):
+        '''
+        Store the payloads of several packets at once.
+        Input:
+            psc: ndarray of int
+                The PSC of each packet.
+            data: ndarray (len(psc), MAX_DATA_SIZE) uint8
+                The payloads.
+            overwrite: bool
+                If False, packets which are already present are kept and for a PSC given several times
+                the first copy is kept. The other copies are counted as duplicates or conflicts (see record_copies).
+            crc: ndarray of uint32 or None
+                The CRC32 of the payloads, computed if None.
+        Output:
+            stored: int
+                The number of packets stored.
+        '''
+        psc = np.asarray(psc, dtype=np.int64)
+        if crc is None:
+            crc = payload_crc(data)
+        keep = (psc >= 1) & (psc <= self.n_packets)
+        if not overwrite:
+            # group the copies of each PSC, the reference payload is the stored one or the first copy
+            order = np.flatnonzero(keep)
+            order = order[np.argsort(psc[order], kind='stable')]
+            p = psc[order]
+            first = np.ones(len(p), dtype=bool)
+            first[1:] = p[1:] != p[:-1]
+            present = self.present[p-1]
+            ref = np.where(present, self.crc[p-1], crc[order][first][np.cumsum(first)-1])
+            new = first & ~present
+            self.record_copies(p[~new], crc[order][~new] == ref[~new])
+            keep[:] = False
+            keep[order[new]] = True
+        index = psc[keep] - 1
+        self.data[index] = data[keep]
+        self.crc[index] = crc[keep]
+        self.completeness.mark_received(index + 1)
+        return len(index)
+
+    def merge(self, other):
+        '''
+        Add the packets of another FilePackets of the same file which are not present yet.
+        '''
+        psc = other.psc()
+        return self.insert_many(psc, other.data[psc-1], overwrite=False, crc=other.crc[psc-1])
+
+    def psc(self):
+        '''
+        The PSC of the received packets, in increasing order.
+        '''
+        return self.completeness.received_psc()
+
+    def content(self):
+        '''
+        The file content as a uint8 view of the packet buffer (no copy), missing packets are zeros.
+        '''
+        return self.data.reshape(-1)[:self.Length]
+
+    def tobytes(self):
+        '''
+        The file content as bytes, missing packets are filled with zeros.
+        '''
+        return self.content().tobytes()
+
+class PacketTable:
+    '''
+    The packets of several files, one FilePackets per file UID.
+    Iterating over the table gives the FilePackets in the order of the file UIDs.
+    '''
+
+    def __init__(self):
+        self.files = {}
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, Filename):
+        return int(Filename) in self.files
+
+    def __getitem__(self, Filename):
+        return self.files[int(Filename)]
+
+    def __iter__(self):
+        return iter([self.files[name] for name in sorted(self.files)])
+
+    def filenames(self):
+        return sorted(self.files)
+
+    def get(self, Filename, Type, Length):
+        '''
+        Return the FilePackets of a file, created from the given header if it does not exist.
+        '''
+        Filename = int(Filename)
+        if Filename not in self.files:
+            self.files[Filename] = FilePackets(Filename, Type, Length)
+        return self.files[Filename]
+
+    def insert(self, Filename, PSC, Type, Length, payload):
+        '''
+        Store one packet in O(1).
+        '''
+        return self.get(Filename, Type, Length).insert(PSC, payload)
+
+    def insert_frames(self, frames):
+        '''
+        Store decoded frames (see frames.decode_frames), grouping them by file once.
+        The header of the first frame of a file defines its Type and Length.
+        '''
+        names = frames['Filename']
+        if len(names) == 0:
+            return
+        order = np.argsort(names, kind='stable')
+        uniq, first = np.unique(names[order], return_index=True)
+        for name, group in zip(uniq.tolist(), np.split(order, first[1:])):
+            packets = self.get(name, frames['Type'][group[0]], frames['Length'][group[0]])
+            # the first copy of a duplicated packet is kept, the others are counted as duplicates or conflicts
+            packets.insert_many(frames['PSC'][group], payloads(frames, group), overwrite=False)
+
+    def insert_DF(self, dataDF):
+        '''
+        Store the packets of a DataFrame (columns Filename, PSC, Type, Length, data).
+        Each payload is written at its PSC, so the row order does not matter.
+        '''
+        for name, PSC, Type, Length, payload in zip(dataDF['Filename'].values.tolist(), dataDF['PSC'].values.tolist(),
+                                                     dataDF['Type'].values.tolist(), dataDF['Length'].values.tolist(),
+                                                     dataDF['data'].values.tolist()):
+            self.get(name, Type, Length).insert(PSC, payload)
+
+    @classmethod
+    def from_DF(cls, dataDF):
+        table = cls()
+        table.insert_DF(dataDF)
+        return table
+
+    @classmethod
+    def from_frames(cls, frames):
+        table = cls()
+        table.insert_frames(frames)
+        return table
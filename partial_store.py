@@ -0,0 +1,265 @@
+import os
+import fcntl
+import struct
+import numpy as np
+from constants import *
+from completeness import Completeness
+from packet_table import FilePackets, packet_count
+from reassembly import OutputFile
+
+# Layout of a partial file in ./tmp/:
+#   [header (STORE_HEADER_SIZE)] + [presence bitmap (ceil(n_packets/8))] + padding to 8 bytes +
+#   [CRC32 of each payload (4*n_packets, big-endian), version 2] + padding +
+#   [slots: the payload of PSC p at data_offset + (p-1)*MAX_DATA_SIZE]
+# Slots of missing packets are never written, the file stays sparse.
+# With the STORE_EXTERNAL flag (incremental reassembly), the payloads are written to the output file
+# instead of the slots (see reassembly.OutputFile) and the store only keeps the header and the bitmap.
+# The STORE_COMPILED flag is set once the complete file is compiled, the store is kept so that later
+# captures of the same file (or concurrent workers) do not compile and report it again.
+STORE_MAGIC = b'VXPS'
+STORE_VERSION = 2
+STORE_HEADER = struct.Struct('>4sBBBxqII') # magic, version, Type, flags, Filename, Length, n_packets
+STORE_EXTERNAL = 1
+STORE_COMPILED = 2
+STORE_FLAGS_OFFSET = 6
+STORE_HEADER_SIZE = 32
+STORE_ALIGN = 4096
+
+def is_store(file_name):
+    '''
+    Check whether a file is a partial store (and not a tmp file of the older sync-marker format).
+    '''
+    with open(file_name, 'rb') as f:
+        return f.read(len(STORE_MAGIC)) == STORE_MAGIC
+
+class PartialStore:
+    '''
+    A partially received file kept on disk with a fixed slot per packet.
+    Received packets are written in place with os.pwrite, so adding packets costs
+    O(new packets) and never rewrites the rest of the file.
+    Use PartialStore.create, open or open_or_create, and close the store (or use it in a with statement).
+    An open store holds an exclusive lock (flock) on the file, so concurrent workers update it one at a time.
+    Attributes:
+        path: str
+        Filename, Type, Length, n_packets: int
+            The header of the file, as in FilePackets.
+        completeness: Completeness
+            The packets stored so far.
+        output: reassembly.OutputFile or None
+            The output file the payloads are written to, None if they are kept in the store.
+        flags: int
+            STORE_EXTERNAL and STORE_COMPILED, see compiled.
+        crc: ndarray (n_packets,) uint32
+            The CRC32 of each stored payload.
+        n_duplicates, conflict_psc:
+            The copies of stored packets given to write_packets since the store was opened, as in FilePackets.
+    '''
+
+    def __init__(self, path, fd, Filename, Type, Length, completeness, output=None, version=STORE_VERSION):
+        self.path = path
+        self.fd = fd
+        self.Filename = Filename
+        self.Type = Type
+        self.Length = Length
+        self.n_packets = completeness.n_packets
+        self.completeness = completeness
+        self.output = output
+        self.flags = STORE_EXTERNAL if output is not None else 0
+        self.version = version
+        self.crc = np.zeros(self.n_packets, dtype=np.uint32)
+        self.n_duplicates = 0
+        self.conflict_psc = set()
+        self.bitmap_offset = STORE_HEADER_SIZE
+        bitmap_end = self.bitmap_offset + (self.n_packets + 7) // 8
+        if version >= 2:
+            self.crc_offset = -(-bitmap_end // 8) * 8
+            bitmap_end = self.crc_offset + 4*self.n_packets
+        self.data_offset = -(-bitmap_end // STORE_ALIGN) * STORE_ALIGN
+
+    @classmethod
+    def create(cls, path, Filename, Type, Length, incremental=False):
+        '''
+        Create an empty store, replacing any existing file at path.
+        If incremental, the payloads are written straight into the output file of the mission data (STORE_EXTERNAL).
+        '''
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return cls._initialize(path, fd, Filename, Type, Length, incremental)
+
+    @classmethod
+    def open(cls, path):
+        '''
+        Open an existing store, reading its header and presence bitmap.
+        '''
+        fd = os.open(path, os.O_RDWR)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            return cls._load(path, fd)
+        except Exception:
+            os.close(fd)
+            raise
+
+    @classmethod
+    def open_or_create(cls, path, Filename, Type, Length, incremental=False):
+        '''
+        Open the store at path, or create it if it does not exist or belongs to another file header.
+        incremental is only used for a new store, see create.
+        '''
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            store = cls._load(path, fd)
+            if (store.Filename, store.Type, store.Length) == (int(Filename), int(Type), int(Length)):
+                return store
+        except ValueError:
+            pass
+        return cls._initialize(path, fd, Filename, Type, Length, incremental)
+
+    @classmethod
+    def _initialize(cls, path, fd, Filename, Type, Length, incremental=False):
+        completeness = Completeness(packet_count(Length))
+        output = None
+        if incremental and completeness.n_packets > 0:
+            try:
+                output = OutputFile(Filename, Type, Length)
+            except ValueError:
+                # unknown type or not an image, keep the payloads in the store
+                output = None
+        store = cls(path, fd, int(Filename), int(Type), int(Length), completeness, output)
+        header = STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, store.Type, store.flags, store.Filename, store.Length, store.n_packets)
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, header.ljust(STORE_HEADER_SIZE, b'\0'), 0)
+        # the slots are only needed if the payloads are kept in the store
+        os.ftruncate(fd, store.data_offset if output else store.data_offset + store.n_packets*MAX_DATA_SIZE)
+        return store
+
+    @classmethod
+    def _load(cls, path, fd):
+        header = os.pread(fd, STORE_HEADER.size, 0)
+        if len(header) < STORE_HEADER.size:
+            raise ValueError(f'{path} is not a partial store')
+        magic, version, Type, flags, Filename, Length, n_packets = STORE_HEADER.unpack(header)
+        if magic != STORE_MAGIC or version not in (1, STORE_VERSION):
+            raise ValueError(f'{path} is not a partial store')
+        completeness = Completeness(n_packets)
+        bitmap = np.frombuffer(os.pread(fd, (n_packets + 7) // 8, STORE_HEADER_SIZE), dtype=np.uint8)
+        completeness.mark_received(np.flatnonzero(np.unpackbits(bitmap, count=n_packets)) + 1)
+        # the output file of a compiled store is already finalized
+        output = OutputFile(Filename, Type, Length) if flags & STORE_EXTERNAL and not flags & STORE_COMPILED else None
+        store = cls(path, fd, Filename, Type, Length, completeness, output, version)
+        store.flags = flags
+        if version >= 2:
+            store.crc[:] = np.frombuffer(os.pread(fd, 4*n_packets, store.crc_offset), dtype='>u4')
+        else:
+            # version 1 has no CRC table, compute it from the payloads
+            store.crc[:] = store.read().crc
+        return store
+
+    def close(self):
+        if self.output is not None:
+            self.output.close()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write_packets(self, packets):
+        '''
+        Write the packets of a FilePackets which are not stored yet.
+        The packets which are already stored are compared by CRC and counted as duplicates or conflicts.
+        Consecutive packets are written with a single pwrite.
+        Input:
+            packets: FilePackets
+                Packets of the same file.
+        Output:
+            n_new: int
+                The number of packets written.
+        '''
+        psc = packets.psc()
+        psc = psc[psc <= self.n_packets]
+        stored = self.completeness.received[psc-1]
+        same = packets.crc[psc[stored]-1] == self.crc[psc[stored]-1]
+        self.n_duplicates += int(np.count_nonzero(same))
+        self.conflict_psc.update(psc[stored][~same].tolist())
+        psc = psc[~stored]
+        if len(psc) == 0:
+            return 0
+
+        # write the payloads first, the bitmap only marks packets which are on disk
+        breaks = np.flatnonzero(np.diff(psc) != 1) + 1
+        for run in np.split(psc, breaks):
+            rows = packets.data[run[0]-1:run[-1]]
+            if self.output is not None:
+                self.output.write(int(run[0]), rows)
+            else:
+                os.pwrite(self.fd, rows, self.data_offset + (int(run[0])-1)*MAX_DATA_SIZE)
+
+        self.crc[psc-1] = packets.crc[psc-1]
+        if self.version >= 2:
+            first, last = int(psc[0])-1, int(psc[-1])
+            os.pwrite(self.fd, self.crc[first:last].astype('>u4'), self.crc_offset + 4*first)
+
+        self.completeness.mark_received(psc)
+        # only the bytes of the bitmap holding the new packets are packed and written
+        first, last = (int(psc[0])-1) // 8, (int(psc[-1])-1) // 8
+        bitmap = np.packbits(self.completeness.received[first*8:(last+1)*8])
+        os.pwrite(self.fd, bitmap, self.bitmap_offset + first)
+        return len(psc)
+
+    def read(self):
+        '''
+        Load the stored packets into a FilePackets.
+        '''
+        packets = FilePackets(self.Filename, self.Type, self.Length)
+        if self.n_packets > 0:
+            size = self.n_packets*MAX_DATA_SIZE
+            if self.output is not None:
+                data = np.zeros(size, dtype=np.uint8)
+                data[:self.Length] = np.frombuffer(self.output.read(), dtype=np.uint8)
+            else:
+                data = np.frombuffer(os.pread(self.fd, size, self.data_offset), dtype=np.uint8)
+            psc = self.completeness.received_psc()
+            crc = self.crc[psc-1] if self.version >= 2 else None
+            packets.insert_many(psc, data.reshape(self.n_packets, MAX_DATA_SIZE)[psc-1], crc=crc)
+        return packets
+
+    @property
+    def compiled(self):
+        '''
+        Whether the complete file has already been compiled from this store.
+        '''
+        return bool(self.flags & STORE_COMPILED)
+
+    def mark_compiled(self, compiled=True):
+        '''
+        Set (or clear) the STORE_COMPILED flag in the header.
+        The flag is read and set while the lock of the store is held, so a file is compiled by one worker only.
+        '''
+        self.flags = self.flags | STORE_COMPILED if compiled else self.flags & ~STORE_COMPILED
+        os.pwrite(self.fd, bytes([self.flags]), STORE_FLAGS_OFFSET)
+
+    def finalize(self):
+        '''
+        For a complete store with an output file (STORE_EXTERNAL): finalize the output file
+        and mark the store as compiled.
+        '''
+        if self.output is None or not self.completeness.is_complete():
+            raise ValueError(f'{self.path} has no complete output file')
+        self.output.finalize()
+        self.mark_compiled()
+
+def save_packets(path, packets, incremental=False):
+    '''
+    Add the packets of a FilePackets to the store at path.
+    The store is created if it does not exist or if it belongs to another file header.
+    Output:
+        n_new: int
+            The number of packets written.
+    '''
+    with PartialStore.open_or_create(path, packets.Filename, packets.Type, packets.Length, incremental) as store:
+        return store.write_packets(packets)
@@ -1,28 +1,35 @@
-def compile_data(DATA_df):
+def compile_data(DATA, wait=True, compression=None):
     
     import sys
     import os
     import numpy as np
-    from astropy.io import fits
+    import pandas as pd
+    import fits_writer
+    from constants import FITS_WRITE_WORKERS
+    from packet_table import PacketTable
     
-    files = set(list(DATA_df['Filename']))
+    # DATA: PacketTable, a list of FilePackets, or a DataFrame of packets
+    # wait: if False, the background FITS writes are not waited for, call fits_writer.wait()
+    # compression: tile compression of the FITS images ('RICE_1', 'GZIP_1', 'GZIP_2'), defaults to FITS_COMPRESSION
+    if isinstance(DATA, pd.DataFrame):
+        DATA = PacketTable.from_DF(DATA)
     
-    for file_name in files:
+    for This_file in DATA:
 
-        This_file = DATA_df[DATA_df['Filename']==file_name]  #get the row of the dataframe where Filename is file_name
-        if This_file['Type'].values[0] == 0:
+        file_name = This_file.Filename
+        if This_file.Type == 0:
             Type = 'fits'
-        elif This_file['Type'].values[0] == 1:
+        elif This_file.Type == 1:
             Type = 'csv'
-        elif This_file['Type'].values[0] == 2:
+        elif This_file.Type == 2:
             Type = 'mix'
-        elif This_file['Type'].values[0] == 3:
+        elif This_file.Type == 3:
             Type = 'txt'
-        elif This_file['Type'].values[0] == 4:
+        elif This_file.Type == 4:
             Type = 'log'
-        elif This_file['Type'].values[0] == 5:
+        elif This_file.Type == 5:
             Type = 'jpg'
-        elif This_file['Type'].values[0] == 6:
+        elif This_file.Type == 6:
             Type = 'H624'
         else:
             sys.exit(4)
@@ -32,43 +39,16 @@ def compile_data(DATA_df):
         if os.path.exists(file_path):
             continue  #if the file already exists, skip to the next file
             
-        DATA = This_file['DATA'].values.tolist()  #get the DATA column from the dataframe
-        length = This_file['Length'].values[0]  #get the Length column from the dataframe
-        data = bytes()
-        for i in range(len(DATA)):
-            data += DATA[i]
-        # data_rs = data.rstrip(b'\0')
-        data_rs = data[:length]  #get the first 'length' bytes from data
+        # each payload is already stored at offset (PSC-1)*MAX_DATA_SIZE, no concatenation nor copy is needed
+        data_rs = This_file.content()  #the first 'Length' bytes of the file
         
         if Type == 'fits':
             try:
-                data_array = np.frombuffer(data_rs,dtype=np.uint16)  #create a numpy array from object(such as bytes or bytearrays)
-                image_data = data_array.reshape(3003,3008)
-                
-                #write a text file
-                a = ['1\n','2\n','3\n']
-                f = open('./mock_header.txt','w')
-                f.writelines(a)  #write line by line
-                f.close()
-
-                #read the text
-                ff = open('./mock_header.txt','r')
-                information = ff.readlines()
-                header_S = []
-                for info in information:
-                    header_S.append(info.strip())  #delete the '\n' after element in a
-
-                #write image data and header information in fits file
-                hdu = fits.PrimaryHDU(image_data)  #fits.PrimaryHDU(data)
-                hdu.header['header1'] = header_S[0]
-                hdu.header['header2'] = header_S[1]
-                hdu.header['header3'] = header_S[2]
-
-                #add the header information
-
+                #write the image with its header built in memory, in the background if FITS_WRITE_WORKERS > 0
+                #tile-compressed (FITS_TILE_SHAPE) if compression or FITS_COMPRESSION is set
                 #if filename isn't an empty string
                 if file_name != "":
-                    hdu.writeto(file_path, overwrite=True)  #write the fits file to the img folder
+                    fits_writer.write_fits(This_file, file_path, background=FITS_WRITE_WORKERS > 0, compression=compression)
             except Exception as e:
                 sys.exit(4)
         else:
@@ -77,5 +57,26 @@ def compile_data(DATA_df):
                     f.write(data_rs)  #write the data to the file
             except Exception as e:
                 sys.exit(4)
-            
-    
\ No newline at end of file
+
+    if wait and fits_writer.wait():
+        sys.exit(4)
+
+def main(file_path):
+    
+    import sys
+    from utility import load_raw_data
+    from utility import find_missing_packets
+    
+    # file_path: a complete file received from the optical receiver, e.g. ./optical/opt_frame_n_Fxxx.bin
+    Data = load_raw_data(file_path)
+    if len(Data) == 0:
+        sys.exit(4)
+    for This_file in Data:
+        missing_seg, missing_rate = find_missing_packets(This_file)
+        if missing_rate != 0:
+            sys.exit(4)  #incomplete file, request again
+    compile_data(Data)
+
+if __name__ == "__main__":
+    import sys
+    main(sys.argv[1])
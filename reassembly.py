@@ -0,0 +1,120 @@
+import os
+import numpy as np
+from constants import *
+import fits_writer
+
+# Incremental reassembly (INCREMENTAL_OUTPUT): the payloads of an incomplete file are written
+# straight into its output file ./Mission_data/<type>/<uid>.<type>.part as the packets arrive,
+# at the offset of their PSC. The .part file is preallocated and sparse, so it can be previewed
+# while packets are missing. Once every packet is there, finalize renames it to the output file.
+# FITS images are written in their final form: the header is written when the file is created
+# and each packet is converted to big-endian int16 (BZERO 32768) when it is written.
+
+def output_path(Filename, Type):
+    '''
+    The output file of a mission file, ./Mission_data/<type>/<uid>.<type>.
+    '''
+    name = MISSION_TYPES[Type]
+    return f'./Mission_data/{name}/{Filename}.{name}'
+
+class OutputFile:
+    '''
+    A sparse, preallocated output file written in place as packets arrive.
+    Attributes:
+        path: str
+            The output file, written to path + '.part' until finalize.
+        Length: int
+            The file length in bytes.
+        is_fits: bool
+            The file is a FITS image (Type 0).
+        data_offset: int
+            The offset of the first byte of the file content (the FITS header size for images).
+    '''
+
+    def __init__(self, Filename, Type, Length, path=None):
+        if not 0 <= Type < len(MISSION_TYPES):
+            raise ValueError(f'unknown file type {Type}')
+        self.Filename = int(Filename)
+        self.Type = int(Type)
+        self.Length = int(Length)
+        self.path = path or output_path(Filename, Type)
+        self.part = self.path + '.part'
+        self.is_fits = Type == 0
+        if self.is_fits:
+            if self.Length != np.prod(fits_writer.IMAGE_SHAPE)*2:
+                raise ValueError(f'{Filename} is not a {fits_writer.IMAGE_SHAPE} uint16 image')
+            self.header = fits_writer.make_header(self)
+            self.header['COMPLETE'] = (False, 'all the packets have been received')
+            self.data_offset = len(self.header.tostring())
+            size = self.data_offset + self.Length + (-self.Length % fits_writer.FITS_BLOCK)
+        else:
+            self.data_offset = 0
+            size = self.Length
+
+        self.fd = os.open(self.part, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size != size:
+            # a new file, or a .part file of another header
+            os.ftruncate(self.fd, 0)
+            if self.is_fits:
+                os.pwrite(self.fd, self.header.tostring().encode('ascii'), 0)
+            os.ftruncate(self.fd, size)
+
+    @property
+    def n_packets(self):
+        return -(-self.Length // MAX_DATA_SIZE)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def write(self, psc, rows):
+        '''
+        Write the payloads of consecutive packets.
+        Input:
+            psc: int
+                The PSC of the first packet.
+            rows: ndarray (n, MAX_DATA_SIZE) uint8
+                The payloads of the packets psc..psc+n-1.
+        '''
+        start = (psc-1)*MAX_DATA_SIZE
+        end = min(start + rows.size, self.Length)
+        if end <= start:
+            return
+        chunk = np.ascontiguousarray(rows).reshape(-1)[:end-start]
+        if not self.is_fits:
+            os.pwrite(self.fd, chunk, self.data_offset + start)
+            return
+
+        # little-endian uint16 -> big-endian int16 - 32768: out[j] = in[j^1], XOR 0x80 on the high byte
+        # a packet may start or end in the middle of a pixel (MAX_DATA_SIZE is odd),
+        # the half pixel at either end is written on its own
+        first = start + (start % 2)
+        last = end - (end % 2)
+        if last > first:
+            pixels = chunk[first-start:last-start].reshape(-1, 2)[:, ::-1] ^ np.array([0x80, 0], dtype=np.uint8)
+            os.pwrite(self.fd, np.ascontiguousarray(pixels), self.data_offset + first)
+        if start % 2:
+            os.pwrite(self.fd, bytes([chunk[0] ^ 0x80]), self.data_offset + start - 1)
+        if end % 2:
+            os.pwrite(self.fd, bytes([chunk[-1]]), self.data_offset + end)
+
+    def read(self):
+        '''
+        The file content written so far (the missing packets are zeros), as the original bytes.
+        '''
+        data = os.pread(self.fd, self.Length, self.data_offset)
+        if self.is_fits:
+            data = (np.frombuffer(data, dtype='>u2') ^ np.uint16(0x8000)).astype('<u2').tobytes()
+        return data
+
+    def finalize(self):
+        '''
+        The file is complete: mark the FITS header as complete and move the .part file to the output file.
+        '''
+        if self.is_fits:
+            self.header['COMPLETE'] = True
+            os.pwrite(self.fd, self.header.tostring().encode('ascii'), 0)
+        os.fsync(self.fd)
+        os.replace(self.part, self.path)
+        self.close()
@@ -0,0 +1,176 @@
+import os
+import csv
+import sqlite3
+from constants import *
+
+# The reports of the ground station, kept in one SQLite table.
+# Each row belongs to one report:
+#   'un_gen'      : incomplete or corrupted files, to be requested by cmd_gen
+#   'final_check' : complete files, waiting for the final confirmation
+#   'report'      : the history of every row which left un_gen or final_check
+REPORTS = ['un_gen', 'final_check', 'report']
+COLUMNS = ['Filename', 'Type', 'Start_Packet_number', 'End_Packet_number', 'Incompleteness']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    report TEXT NOT NULL,
+    Filename,
+    Type TEXT,
+    Start_Packet_number INTEGER,
+    End_Packet_number INTEGER,
+    Incompleteness
+);
+CREATE INDEX IF NOT EXISTS reports_file ON reports (report, Filename);
+'''
+
+def csv_value(value):
+    # the CSV files do not keep the types: UIDs and packet numbers are ints, rates are floats
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+def read_csv_rows(fin_name):
+    '''
+    Read the rows of a report CSV file (see csv_header), [] if the file does not exist.
+    '''
+    if not os.path.isfile(fin_name):
+        return []
+    with open(fin_name, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return [[csv_value(row[0]), row[1], *map(csv_value, row[2:5])] for row in reader if row]
+
+def file_keys(Filename):
+    # the UID may have been stored as an int or as a string
+    key = str(Filename)
+    return (int(key), key) if key.isdigit() else (key, key)
+
+class ReportStore:
+    '''
+    Transactional store of the report rows (Filename, Type, Start_Packet_number, End_Packet_number, Incompleteness),
+    indexed by report and file UID. Every method is a single transaction, so several processes can write
+    at the same time. The CSV files in ./report/ are exported from it with export_csv.
+    A new store is seeded with the rows of the CSV files already in csv_folder (the folder of the store by default),
+    so the pending requests and the report history written before the store existed are kept.
+    '''
+
+    def __init__(self, path=report_db_path, csv_folder=None):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        if csv_folder is None:
+            csv_folder = os.path.dirname(path)
+        # the schema is created and seeded in one transaction, so two processes cannot both seed the store
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            new = self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reports'").fetchone() is None
+            for statement in SCHEMA.split(';')[:-1]:
+                self.conn.execute(statement)
+            if new:
+                for report in REPORTS:
+                    self.conn.executemany(
+                        f'INSERT INTO reports (report, {", ".join(COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)',
+                        [(report, *row) for row in read_csv_rows(os.path.join(csv_folder, f'{report}.csv'))])
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, report, rows):
+        '''
+        Append rows to a report.
+        Input:
+            report: str
+                One of REPORTS.
+            rows: list of lists/tuples
+                [Filename, Type, Start_Packet_number, End_Packet_number, Incompleteness]
+        '''
+        self.add_many({report: rows})
+
+    def add_many(self, rows_by_report, supersede=()):
+        '''
+        Append rows to several reports in one transaction.
+        Input:
+            rows_by_report: dict
+                report -> rows, see add.
+            supersede: iterable of file UIDs
+                Files whose 'Missing' and 'Error' un_gen rows are out of date, they go to the 'report' history first.
+        '''
+        with self.conn:
+            for Filename in supersede:
+                self.conn.execute("UPDATE reports SET report = 'report' WHERE report = 'un_gen' "
+                                  "AND Type IN ('Missing', 'Error') AND Filename IN (?, ?)", file_keys(Filename))
+            for report, rows in rows_by_report.items():
+                self.conn.executemany(
+                    f'INSERT INTO reports (report, {", ".join(COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)',
+                    [(report, *row) for row in rows])
+
+    def fetch(self, report):
+        '''
+        Read the rows of a report, in the order they were added.
+        Output:
+            ids: list of int
+                The row ids, for archive.
+            rows: list of lists
+                [Filename, Type, Start_Packet_number, End_Packet_number, Incompleteness]
+        '''
+        cur = self.conn.execute(f'SELECT id, {", ".join(COLUMNS)} FROM reports WHERE report = ? ORDER BY id', (report,))
+        ids, rows = [], []
+        for row in cur:
+            ids.append(row[0])
+            rows.append(list(row[1:]))
+        return ids, rows
+
+    def archive(self, ids):
+        '''
+        Move rows (from fetch) to the 'report' history.
+        '''
+        with self.conn:
+            self.conn.executemany("UPDATE reports SET report = 'report' WHERE id = ?", [(i,) for i in ids])
+
+    def clear(self, report):
+        '''
+        Delete every row of a report.
+        '''
+        with self.conn:
+            self.conn.execute('DELETE FROM reports WHERE report = ?', (report,))
+
+    def confirm(self, Filename, failed, request=True):
+        '''
+        Final confirmation of a compiled file: its final_check rows go to the 'report' history
+        (as an Error row if it failed), and if request is True an OK or Error row is added to un_gen for cmd_gen.
+        '''
+        keys = file_keys(Filename)
+        with self.conn:
+            if failed:
+                self.conn.execute("DELETE FROM reports WHERE report = 'final_check' AND Filename IN (?, ?)", keys)
+                self.conn.execute(f'INSERT INTO reports (report, {", ".join(COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)',
+                                  ('report', Filename, 'Error', 65535, 65535, 100))
+            else:
+                self.conn.execute("UPDATE reports SET report = 'report' WHERE report = 'final_check' AND Filename IN (?, ?)", keys)
+            if request:
+                row = [Filename, 'Error', 65535, 65535, 100] if failed else [Filename, 'OK', 0, 0, 0]
+                self.conn.execute(f'INSERT INTO reports (report, {", ".join(COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)',
+                                  ('un_gen', *row))
+
+    def export_csv(self, folder=report_path):
+        '''
+        Write <report>.csv in folder for every report, in the format of csv_header.
+        Each file is replaced atomically.
+        '''
+        for report in REPORTS:
+            ids, rows = self.fetch(report)
+            fout_name = os.path.join(folder, f'{report}.csv')
+            with open(fout_name + '.part', 'w') as f:
+                f.write(csv_header)
+                f.writelines(','.join(str(v) for v in row) + '\n' for row in rows)
+            os.replace(fout_name + '.part', fout_name)
@@ -0,0 +1,164 @@
+import os
+import numpy as np
+from constants import *
+from partial_store import PartialStore, is_store
+from uid_codec import unix_from_uid
+from cmd_gen import list_shorten, add_request_rate, pack_requests, save_to_csv
+
+# Choose the retransmission requests of a pass under an uplink budget (number of commands)
+# and a downlink window (number of packets), instead of requesting every un_gen row.
+# Each candidate request is worth the missing bytes it recovers times the priority of the file
+# (TYPE_PRIORITY, AGE_PRIORITY), and costs one command and the packets it downlinks.
+# The candidates are taken greedily by value per cost until a budget is used up.
+
+def file_priority(Type, Filename, now):
+    '''
+    The priority of a file: the priority of its type (1 if unknown) plus AGE_PRIORITY per day since it was taken.
+    '''
+    try:
+        age_days = max(now.timestamp() - unix_from_uid(Filename), 0) / 86400
+    except ValueError:
+        age_days = 0
+    return TYPE_PRIORITY.get(Type, 1) + AGE_PRIORITY*age_days
+
+def file_state(Filename, rows, total_packet):
+    '''
+    The current state of an incomplete file, from its tmp file if there is one, else from its un_gen rows.
+    Output:
+        Type: int or None
+            The file type, None if unknown.
+        n_packets: int
+            The number of packets of the file.
+        ranges: ndarray (n_ranges, 2) or None
+            The missing ranges (first and last PSC), None if the whole file has to be requested.
+    '''
+    tmp_file = f'./tmp/tmp_{Filename}'
+    if os.path.exists(tmp_file) and is_store(tmp_file):
+        with PartialStore.open(tmp_file) as store:
+            if store.n_packets > 0:
+                return store.Type, store.n_packets, store.completeness.missing_ranges()
+    if any(row[1] == 'Error' for row in rows):
+        return None, total_packet, None
+    ranges = np.array(sorted((row[2], row[3]) for row in rows), dtype=np.int64).reshape(-1, 2)
+    return None, total_packet, ranges
+
+def make_candidates(list_packet, N_id, rate_for_all, total_packet, now):
+    '''
+    The candidate requests of the incomplete files.
+    A file missing more than rate_for_all (or reported as Error) is requested as a whole (0..total_packet),
+    else its missing ranges are reduced to N_id segments with list_shorten, one candidate per segment.
+    Output:
+        candidates: list of [value, n_downlink, Filename, request row]
+    '''
+    rows_by_file = {}
+    for row in list_packet:
+        rows_by_file.setdefault(row[0], []).append(row)
+
+    candidates = []
+    for Filename, rows in rows_by_file.items():
+        Type, n_packets, ranges = file_state(Filename, rows, total_packet)
+        priority = file_priority(Type, Filename, now)
+        n_missing = n_packets if ranges is None else int(np.sum(ranges[:, 1] - ranges[:, 0] + 1))
+        missing_rate = 100*n_missing/max(n_packets, 1)
+        if n_missing == 0:
+            continue
+        if ranges is None or missing_rate >= rate_for_all:
+            row = [Filename, rows[0][1], 0, total_packet, missing_rate, 1]
+            candidates.append([n_missing*MAX_DATA_SIZE*priority, total_packet + 1, Filename, row])
+            continue
+        segments = list_shorten([[Filename, 'Missing', int(s), int(e), missing_rate] for s, e in ranges], N_id)
+        segments = add_request_rate(segments, total_packet)
+        # packets of a merged segment which are already received are downlinked but recover nothing
+        cum_missing = np.concatenate(([0], np.cumsum(ranges[:, 1] - ranges[:, 0] + 1)))
+        for seg in segments:
+            first = np.searchsorted(ranges[:, 0], seg[2])
+            last = np.searchsorted(ranges[:, 1], seg[3], side='right')
+            recovered = int(cum_missing[last] - cum_missing[first])
+            candidates.append([recovered*MAX_DATA_SIZE*priority, seg[3] - seg[2] + 1, Filename, seg])
+    return candidates
+
+def is_covered(row, segments, total_packet):
+    '''
+    Whether the packets of an un_gen row are all requested by segments ([Start_Packet_number, End_Packet_number] of a file).
+    A request of the whole file (0..total_packet) covers every row of the file, including its Error rows.
+    '''
+    merged = []
+    for start, end in sorted(segments):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    if any(start <= 0 and end >= total_packet for start, end in merged):
+        return True
+    return row[1] != 'Error' and any(start <= row[2] and row[3] <= end for start, end in merged)
+
+def schedule(list_packet_t, N_id, rate_for_all, total_packet, now,
+             uplink_budget=UPLINK_BUDGET, downlink_window=DOWNLINK_WINDOW):
+    '''
+    Choose the commands of a pass.
+    Input:
+        list_packet_t: list of lists
+            The rows of the un_gen report.
+        N_id, rate_for_all, total_packet:
+            As in cmd_gen.command_order.
+        now: datetime.datetime
+            The time of the pass, for the age of the files.
+        uplink_budget: int
+            The number of commands which can be sent.
+        downlink_window: int
+            The number of packets which can be downlinked.
+    Output:
+        list_req: list of lists
+            The request rows (Filename, Type, Start_Packet_number, End_Packet_number, Incompleteness, req_rate).
+        list_del: list of lists
+            The delete rows of the complete files.
+        scheduled: list of int
+            The indices in list_packet_t of the rows handled in this pass, the others are left for the next pass.
+    '''
+    list_OK = [i for i, row in enumerate(list_packet_t) if row[1] == 'OK']
+    list_packet = [row for row in list_packet_t if row[1] != 'OK']
+
+    # deleting complete files frees the onboard storage and costs no downlink, they go first
+    list_del = [list_packet_t[i][:5] + [0] for i in list_OK[:uplink_budget]]
+    scheduled = list_OK[:uplink_budget]
+    uplink_left = uplink_budget - len(list_del)
+    downlink_left = downlink_window
+
+    candidates = make_candidates(list_packet, N_id, rate_for_all, total_packet, now)
+    value = np.array([c[0] for c in candidates], dtype=float)
+    cost = np.array([1/max(uplink_budget, 1) + c[1]/max(downlink_window, 1) for c in candidates])
+    list_req = []
+    requested = {}
+    for i in np.argsort(-value/cost, kind='stable'):
+        if uplink_left == 0:
+            break
+        if candidates[i][1] <= downlink_left:
+            list_req.append(candidates[i][3])
+            requested.setdefault(candidates[i][2], []).append(candidates[i][3][2:4])
+            uplink_left -= 1
+            downlink_left -= candidates[i][1]
+
+    # only the rows covered by the requested segments leave un_gen, the other segments of a file are left for the next pass
+    scheduled += [i for i, row in enumerate(list_packet_t)
+                  if row[1] != 'OK' and row[0] in requested and is_covered(row, requested[row[0]], total_packet)]
+    list_req.sort(key=lambda row: (str(row[0]), row[2]))
+    return list_req, list_del, sorted(scheduled)
+
+def command_schedule(list_packet_t, fol_lis, N_req, N_id, rate_for_all, total_packet, now,
+                     uplink_budget=UPLINK_BUDGET, downlink_window=DOWNLINK_WINDOW):
+    '''
+    The scheduled equivalent of cmd_gen.command_order: write the REQ and DEL lists of a pass in fol_lis,
+    in the format read by cmd_gen.command_bin.
+    Output:
+        scheduled: list of int
+            The indices in list_packet_t of the rows handled in this pass, see schedule.
+    '''
+    list_req, list_del, scheduled = schedule(list_packet_t, N_id, rate_for_all, total_packet, now,
+                                             uplink_budget, downlink_window)
+    n_csv = 0
+    for com_list in pack_requests(list_req, N_req):
+        save_to_csv(fol_lis + 'REQ', n_csv, com_list)
+        n_csv += 1
+    for n_csv, pac_t in enumerate(list_del):
+        save_to_csv(fol_lis + 'DEL', n_csv, [pac_t])
+    return scheduled
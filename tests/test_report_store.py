@@ -0,0 +1,41 @@
+import os
+from constants import csv_header
+from report_store import ReportStore, REPORTS
+
+ROWS = {
+    'un_gen': [[20231115071320, 'Missing', 10, 25, 12.5], ['F20231115071321.bin', 'Error', 65535, 65535, 100]],
+    'final_check': [[20231115071322, 'OK', 0, 0, 0]],
+    'report': [[20231115071300, 'Missing', 0, 99, 0.602], [20231115071300, 'OK', 0, 0, 0]],
+}
+
+def write_csv(folder, report, rows):
+    with open(os.path.join(folder, f'{report}.csv'), 'w') as f:
+        f.write(csv_header)
+        f.writelines(','.join(str(v) for v in row) + '\n' for row in rows)
+
+def read_csv(folder, report):
+    with open(os.path.join(folder, f'{report}.csv')) as f:
+        return f.read()
+
+def test_new_store_is_seeded_from_csv(tmp_path):
+    for report in REPORTS:
+        write_csv(tmp_path, report, ROWS[report])
+    before = {report: read_csv(tmp_path, report) for report in REPORTS}
+
+    with ReportStore(str(tmp_path / 'report.db')) as store:
+        for report in REPORTS:
+            assert store.fetch(report)[1] == ROWS[report]
+        store.export_csv(str(tmp_path))
+    assert {report: read_csv(tmp_path, report) for report in REPORTS} == before
+
+def test_existing_store_is_not_seeded_again(tmp_path):
+    write_csv(tmp_path, 'un_gen', ROWS['un_gen'])
+    with ReportStore(str(tmp_path / 'report.db')) as store:
+        store.add('un_gen', [[20231115071323, 'Missing', 1, 2, 0.01]])
+        store.export_csv(str(tmp_path))
+    with ReportStore(str(tmp_path / 'report.db')) as store:
+        assert store.fetch('un_gen')[1] == ROWS['un_gen'] + [[20231115071323, 'Missing', 1, 2, 0.01]]
+
+def test_new_store_without_csv_is_empty(tmp_path):
+    with ReportStore(str(tmp_path / 'report.db')) as store:
+        assert all(store.fetch(report)[1] == [] for report in REPORTS)
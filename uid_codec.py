@@ -0,0 +1,120 @@
+import datetime
+import functools
+import numpy as np
+from constants import *
+
+# File UIDs are the time a file was taken, YYYYMMDDhhmmss, carried as an int (e.g. 20231115071320).
+# The MDPU header and the uplink commands carry the same time as a UNIX timestamp.
+# Both directions are computed with integer calendar arithmetic in the fixed time zone UID_UTC_OFFSET,
+# so the UIDs do not depend on the time zone of the host, and arrays are converted without a loop.
+# The scalar conversions are memoized: a capture or a command list only has a few distinct files.
+
+UID_TIMEZONE = datetime.timezone(datetime.timedelta(hours=UID_UTC_OFFSET))
+OFFSET = int(UID_UTC_OFFSET*3600)
+
+def civil_from_days(days):
+    '''
+    The (year, month, day) of a number of days since 1970-01-01 (proleptic Gregorian calendar).
+    Works on ints and on integer ndarrays.
+    '''
+    z = days + 719468
+    era = z // 146097
+    doe = z - era*146097
+    yoe = (doe - doe//1460 + doe//36524 - doe//146096) // 365
+    doy = doe - (365*yoe + yoe//4 - yoe//100)
+    mp = (5*doy + 2) // 153
+    day = doy - (153*mp + 2)//5 + 1
+    month = mp + 3 - 12*(mp >= 10)
+    year = yoe + era*400 + (month <= 2)
+    return year, month, day
+
+def days_from_civil(year, month, day):
+    '''
+    The number of days since 1970-01-01 of a date, the inverse of civil_from_days.
+    '''
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era*400
+    doy = (153*(month - 3 + 12*(month <= 2)) + 2)//5 + day - 1
+    doe = yoe*365 + yoe//4 - yoe//100 + doy
+    return era*146097 + doe - 719468
+
+def uids_from_unix(unix_time):
+    '''
+    Convert UNIX timestamps to file UIDs.
+    Input:
+        unix_time: array-like of int
+    Output:
+        uids: ndarray of int64
+            YYYYMMDDhhmmss in UID_TIMEZONE.
+    '''
+    local = np.asarray(unix_time, dtype=np.int64) + OFFSET
+    days, seconds = local // 86400, local % 86400
+    year, month, day = civil_from_days(days)
+    return (((year*100 + month)*100 + day)*100 + seconds//3600)*10000 + (seconds//60 % 60)*100 + seconds % 60
+
+def unix_from_uids(uids):
+    '''
+    Convert file UIDs to UNIX timestamps.
+    Input:
+        uids: array-like of int
+            YYYYMMDDhhmmss in UID_TIMEZONE.
+    Output:
+        unix_time: ndarray of int64
+        Raises ValueError if a UID is not a valid date and time.
+    '''
+    uids = np.asarray(uids, dtype=np.int64)
+    date, clock = uids // 1000000, uids % 1000000
+    year, month, day = date // 10000, date // 100 % 100, date % 100
+    hour, minute, second = clock // 10000, clock // 100 % 100, clock % 100
+    unix_time = days_from_civil(year, month, day)*86400 + hour*3600 + minute*60 + second - OFFSET
+    # out of range fields (month 13, February 30, 24:00:00...) do not convert back to the same UID
+    if not np.array_equal(uids_from_unix(unix_time), uids):
+        raise ValueError('invalid file UID')
+    return unix_time
+
+@functools.lru_cache(maxsize=None)
+def uid_from_unix(unix_time):
+    '''
+    The file UID (int) of a UNIX timestamp.
+    '''
+    return int(uids_from_unix(int(unix_time)))
+
+@functools.lru_cache(maxsize=None)
+def unix_from_uid(uid):
+    '''
+    The UNIX timestamp of a file UID.
+    Input:
+        uid: int or str
+            The UID (YYYYMMDDhhmmss, as int or str) or a file name F20YYMMDDhhmmss.bin.
+    Output:
+        unix_time: int
+        Raises ValueError if uid is not a UID.
+    '''
+    name = str(uid)
+    if name.startswith('F'):
+        name = name[1:]
+    if not name[:14].isdigit() or len(name[:14]) != 14:
+        raise ValueError(f'invalid file UID {uid}')
+    try:
+        return int(unix_from_uids(int(name[:14])))
+    except ValueError:
+        raise ValueError(f'invalid file UID {uid}') from None
+
+def uid_string(uid):
+    '''
+    The UID as the 14-digit string YYYYMMDDhhmmss.
+    '''
+    return f'{int(uid):014d}'
+
+def uid_datetime(uid):
+    '''
+    The time of a file UID as an aware datetime in UTC.
+    '''
+    return datetime.datetime.fromtimestamp(unix_from_uid(uid), datetime.timezone.utc)
+
+def now():
+    '''
+    The current time in UID_TIMEZONE, e.g. for the names of the command lists.
+    '''
+    return datetime.datetime.now(UID_TIMEZONE)
@@ -1,9 +1,17 @@
 import glob
 import os
 import sys 
-import datetime
+import time
 import pandas as pd
 from constants import *
+import metrics
+from uid_codec import uid_from_unix, uid_string
+from frames import map_file, decode_frames, decode_tmp_records, payload_views, iter_frame_batches
+from integrity import verify_frames
+from packet_table import PacketTable, FilePackets, packet_count
+from completeness import Completeness
+from partial_store import PartialStore, is_store, save_packets
+from report_store import ReportStore
 
 def process_packet(raw_packet):
     """
@@ -51,9 +59,8 @@ def process_packet(raw_packet):
     seq = int.from_bytes(transmitter_packet[2:5], 'big')
     mdpu_header = transmitter_packet[6:28]
     payload = transmitter_packet[28:28+MAX_DATA_SIZE]
-    fname = datetime.datetime.fromtimestamp(int.from_bytes(mdpu_header[9:13],'big'))
-    file_uid = fname.strftime('%Y%m%d%H%M%S')
-    ptype = int.from_bytes(mdpu_header[21], 'big')
+    file_uid = uid_string(uid_from_unix(int.from_bytes(mdpu_header[9:13],'big')))
+    ptype = mdpu_header[21]
     actual_file_length = int.from_bytes(mdpu_header[17:21], 'big')
    
     return seq, ptype, actual_file_length, payload, file_uid
@@ -70,27 +77,84 @@ def DF_raw_data(file_path):
             The DataFrame containing the header information.
     '''
     
-    with open(file_path, 'rb') as f:
-        packet_chunks = f.read().split(SYNC_MARKER)[1:]
+    return frames_to_DF(read_frames(file_path))
 
-    seq, ptype, actual_file_length, payload, file_uid = [], [], [], [], []
-    for chunk in packet_chunks:
-        result = process_packet(chunk)
-        if result is None:
-            continue
-        seq.append(result[0])
-        ptype.append(result[1])
-        actual_file_length.append(result[2])
-        payload.append(result[3])
-        file_uid.append(result[4])
+def read_frames(file_path):
+    
+    '''
+    Decode the frames of a raw data file and drop the frames which fail the integrity checks.
+    The frames, bytes and decoding time are recorded in the metrics (see metrics.py).
+    '''
+    
+    t0 = time.perf_counter()
+    arr = map_file(file_path)
+    frames = decode_frames(arr)
+    metrics.record_decode(len(frames['PSC']), len(arr), time.perf_counter() - t0)
+    return verify_frames(frames)
+
+def load_raw_data(file_path):
+    
+    '''
+    Read the raw data file into a PacketTable, one packet buffer per file UID.
+    Frames which fail the integrity checks (see integrity.py) are dropped, their packets are missing.
+    Input:
+        file_path: str
+            The path of the raw data file.
+    Output:
+        table: PacketTable
+            The packets of every file found in the raw data file.
+    '''
+    
+    return PacketTable.from_frames(read_frames(file_path))
+
+def iter_raw_data(source, chunk_size=STREAM_CHUNK_SIZE, follow_timeout=0):
+    
+    '''
+    Read a raw data file or pipe incrementally and yield its packets one by one.
+    The memory used does not depend on the size of the capture.
+    Input:
+        source: str or binary file object
+            The path of the raw data file, or an open stream such as sys.stdin.buffer.
+        chunk_size: int
+            The number of bytes read at once.
+        follow_timeout: float
+            If > 0, wait for data appended to the file until it is idle for this many seconds.
+    Output:
+        generator of tuples (seq, ptype, actual_file_length, payload, file_uid)
+            The same fields as process_packet, with payload as a memoryview and file_uid as int.
+    '''
+    
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            yield from iter_raw_data(f, chunk_size, follow_timeout)
+        return
+    
+    for frames in iter_frame_batches(source, chunk_size, follow_timeout):
+        metrics.inc('frames_decoded', len(frames['PSC']))
+        frames = verify_frames(frames)
+        rows = zip(frames['PSC'].tolist(), frames['Type'].tolist(), frames['Length'].tolist(),
+                   payload_views(frames), frames['Filename'].tolist())
+        yield from rows
+
+def frames_to_DF(frames):
+    
+    '''
+    Build the packet DataFrame from decoded frames.
+    The 'data' column holds memoryviews into the mapped file, the payloads are not copied.
+    Input:
+        frames: dict
+            The output of frames.decode_frames or frames.decode_tmp_records.
+    Output:
+        dataDF: DataFrame
+            The DataFrame containing the header information and the payloads.
+    '''
     
-    # Create a DataFrame from the collected data
     dataDF = pd.DataFrame({
-        'Filename': pd.Series(file_uid, dtype=int),
-        'PSC': pd.Series(seq, dtype=int),
-        'Type': pd.Series(ptype, dtype=int),
-        'Length': pd.Series(actual_file_length, dtype=int),
-        'data': pd.Series(payload, dtype='object')  # Preserve binary data
+        'Filename': pd.Series(frames['Filename'], dtype=int),
+        'PSC': pd.Series(frames['PSC'], dtype=int),
+        'Type': pd.Series(frames['Type'], dtype=int),
+        'Length': pd.Series(frames['Length'], dtype=int),
+        'data': pd.Series(payload_views(frames), dtype='object')  # Preserve binary data
     })
     
     return dataDF
@@ -123,99 +187,214 @@ def find_consecutive_ranges(lst):
 
 def find_missing_packets(data):
     """
-    Find the missing packets in the raw data file.
+    Find the missing packets of a file.
     Input:
-        data: DataFrame
-            The DataFrame containing the raw data.
+        data: FilePackets, Completeness or DataFrame
+            The packets of one file.
     Output:
         missing_segments: list
-            A list of tuples, each containing the start and end of a missing packet range.
+            A list of lists, each containing the start and end of a missing packet range.
         missing_rate: float
             The percentage of missing packets in the file.
     """
     
-    Lengths = data['Length'].iloc[0]
+    if isinstance(data, FilePackets):
+        completeness = data.completeness
+    elif isinstance(data, Completeness):
+        completeness = data
+    else:
+        completeness = Completeness(packet_count(data['Length'].iloc[0]))
+        completeness.mark_received(data['PSC'].values)
     
-    if Lengths == 0: # nothing in the file
+    if completeness.n_packets == 0: # nothing in the file
         return -1, 100
     else: 
-        PSC = set(range(1, Lengths+1))
-        missed = PSC - set(data['PSC'])
-        missing_rate = (len(missed)/Lengths)*100
-        return find_consecutive_ranges(list(missed)), missing_rate
+        return completeness.missing_ranges().tolist(), completeness.missing_rate
+
+def record_file(data, result, completeness=None):
+    
+    '''
+    Record a checked file in the metrics: its result ('complete', 'incomplete', 'error'),
+    its missing packets, and the copies of received packets (dedup hits and conflicts).
+    Input:
+        data: FilePackets or PartialStore
+        result: str
+        completeness: Completeness or None
+            The packets of the file received so far, if not the ones of data (e.g. the tmp file of a capture).
+    '''
+    
+    if completeness is None:
+        completeness = data.completeness
+    metrics.inc('files_checked', result=result)
+    metrics.inc('packets_missing', completeness.n_missing)
+    metrics.inc('packets_duplicate', data.n_duplicates)
+    metrics.inc('packets_conflict', len(data.conflict_psc))
+
+def conflict_rows(filename, conflict_psc, n_packets):
+    
+    '''
+    The report rows of the packets received several times with different payloads (see FilePackets.conflict_psc).
+    Output:
+        rows: list of lists
+            [filename, 'Conflict', first PSC, last PSC, percentage of conflicting packets] for each consecutive range.
+    '''
+    
+    rate = 100*len(conflict_psc)/max(n_packets, 1)
+    return [[filename, 'Conflict', segment[0], segment[1], rate] for segment in find_consecutive_ranges(list(conflict_psc))]
 
-def encode_data(filename, data, sync_bytes=SYNC_MARKER):
+def write_reports(report_incpl, report_cpl, store=None):
+    
     '''
-    Store the incomplete data into a binary file at ./tmp/ with the specified format.
+    Add report rows to the un_gen (incomplete files) and final_check (complete files) reports
+    in a single transaction of the report store (see report_store.py).
+    The 'Conflict' rows are not requests, they go to the report history.
+    The 'Missing' and 'OK' rows describe the whole file as it is stored now (its partial store in ./tmp/),
+    so they replace the 'Missing' and 'Error' un_gen rows of the same file which were not requested yet.
+    Input:
+        report_incpl: list of lists
+            The rows for un_gen.
+        report_cpl: list of lists
+            The rows for final_check.
+        store: ReportStore
+            The store to write to. If None, ./report/report.db is opened and the CSV files
+            in ./report/ are exported after writing.
+    '''
+    
+    rows = {'un_gen': [row for row in report_incpl if row[1] != 'Conflict'],
+            'final_check': report_cpl,
+            'report': [row for row in report_incpl if row[1] == 'Conflict']}
+    supersede = {row[0] for row in report_incpl if row[1] == 'Missing'} | {row[0] for row in report_cpl}
+    if store is not None:
+        with metrics.timer('report_write'):
+            store.add_many(rows, supersede)
+        return
+    with ReportStore() as store:
+        with metrics.timer('report_write'):
+            store.add_many(rows, supersede)
+        with metrics.timer('report_export'):
+            store.export_csv(report_path)
+    print(f'Report file: {report_db_path}')
+
+def wait_writes(report_cpl):
+    
+    '''
+    Wait for the FITS files written in the background (FITS_WRITE_WORKERS) and drop the final_check rows
+    of the files which could not be written. Called on every exit path of a check or a combine,
+    so the writes of a raw file are never left pending for the next one.
+    Input:
+        report_cpl: list of lists
+            The rows for the final_check report.
+    Output:
+        report_cpl: list of lists
+            The rows of the files which were written.
+        failed: list of int
+            The UID of the files which could not be written.
+    '''
+    
+    import fits_writer
+    if not fits_writer.pending:
+        return report_cpl, []
+    with metrics.timer('compile'):
+        failed = fits_writer.wait()
+    for Filename in failed:
+        # the file can be compiled again from its partial store
+        tmp_file = f'./tmp/tmp_{Filename}'
+        if os.path.exists(tmp_file) and is_store(tmp_file):
+            with PartialStore.open(tmp_file) as store:
+                store.mark_compiled(False)
+    return [row for row in report_cpl if row[0] not in failed], failed
+
+def compile_store(store):
+    
+    '''
+    Compile the file of a complete partial store and mark the store as compiled.
+    Call it with the store open (its lock held) and only if store.compiled is False,
+    so that a file completed by several captures at the same time is compiled and reported once.
+    Input:
+        store: PartialStore
+            A complete store.
+    '''
+    
+    if store.output is not None:
+        # incremental reassembly, the output file is already written
+        store.finalize()
+        return
+    from read_bin import compile_data
+    with metrics.timer('compile'):
+        compile_data([store.read()], wait=False)
+    store.mark_compiled()
+
+def encode_data(filename, data):
+    '''
+    Store the incomplete data into a partial store at ./tmp/ (see partial_store.py).
+    If the store already exists for this file, only the packets it does not have yet are written.
     Input:
         filename: str
             The name of the file to write the data to.
-        data: DataFrame
-            The DataFrame containing the data to be written.
-        sync_bytes: bytes
-            The sync bytes to be written at the beginning of each packet.
+        data: FilePackets
+            The packets of the file to be written.
     '''
     try:
-        fname_list = data['Filename'].values.tolist()
-        PSC_list = data['PSC'].values.tolist()
-        type_list = data['Type'].values.tolist()
-        length_list = data['Length'].values.tolist()
-        data_list = data['data'].values.tolist()
-        with open(filename, 'wb') as f: 
-            for i in range(0, len(data_list)):
-                f.write(sync_bytes)
-                # Convert the filename to a datetime object and then to Unix time
-                YYYY = int(fname_list[i][:4])
-                MM = int(fname_list[i][4:6])
-                DD = int(fname_list[i][6:8])
-                hh = int(fname_list[i][8:10])
-                mm = int(fname_list[i][10:12])
-                ss = int(fname_list[i][12:14])
-                fname = datetime.datetime(YYYY,MM,DD,hh,mm,ss)
-                unix_time = int(fname.timestamp())
-                fname_bytes = unix_time.to_bytes(4, byteorder='big')
-                f.write(fname_bytes)
-                PSC_bytes = PSC_list[i].to_bytes(3, byteorder='big')
-                f.write(PSC_bytes)
-                Type_bytes = type_list[i].to_bytes(1, byteorder='big')
-                f.write(Type_bytes)
-                Length_bytes = length_list[i].to_bytes(4, byteorder='big')
-                f.write(Length_bytes)
-                f.write(data_list[i])
-            print(f"Data write to {filename}")
+        # with INCREMENTAL_OUTPUT, the payloads go straight into the output file (see reassembly.py)
+        n_new = save_packets(filename, data, INCREMENTAL_OUTPUT)
+        metrics.inc('packets_written', n_new)
+        print(f"Data write to {filename} ({n_new} new packets)")
             
     except Exception as e:
          print(f"Error writing to file: {e}")
 
-def DF_tmp_data(file_name):
+def load_tmp_data(file_name):
     
     '''
-    Decode the temporary data file compiled by encode_data function.
+    Read the temporary data file compiled by encode_data function into a PacketTable.
+    Files in the older sync-marker format are still readable.
     input:
         file_name: str
             The name of the temporary data file to read.
     output:
-        headerDF: DataFrame
-            A DataFrame containing the header information extracted from the file.
+        table: PacketTable
+            The packets stored in the file.
     '''
     
-    with open(file_name, 'rb') as f:
-        mpduPackets = f.read().split(SYNC_MARKER)[1:]
+    if is_store(file_name):
+        table = PacketTable()
+        with PartialStore.open(file_name) as store:
+            packets = store.read()
+        table.files[packets.Filename] = packets
+        return table
+    
+    return PacketTable.from_frames(decode_tmp_records(map_file(file_name)))
 
-    for packet in mpduPackets:
-        fname = datetime.datetime.fromtimestamp(int.from_bytes(packet[:4],'big'))
-        psc = int.from_bytes(packet[4:7], 'big')
-        ptype = int.from_bytes(packet[7:8], 'big')
-        length = int.from_bytes(packet[8:12], 'big')
-        data = packet[12:]
-        
-    headerDF = pd.DataFrame({
-        'Filename': pd.Series(fname, dtype=int),
+def packets_to_DF(packets):
+    
+    '''
+    Build the packet DataFrame of one file from a FilePackets.
+    The 'data' column holds memoryviews into the packet buffer.
+    '''
+    
+    psc = packets.psc()
+    mv = memoryview(packets.data.reshape(-1))
+    return pd.DataFrame({
+        'Filename': pd.Series([packets.Filename]*len(psc), dtype=int),
         'PSC': pd.Series(psc, dtype=int),
-        'Type': pd.Series(ptype, dtype=int),
-        'Length': pd.Series(length, dtype=int),
-        'data': pd.Series(data, dtype='object')  # Preserve binary data
+        'Type': pd.Series([packets.Type]*len(psc), dtype=int),
+        'Length': pd.Series([packets.Length]*len(psc), dtype=int),
+        'data': pd.Series([mv[(p-1)*MAX_DATA_SIZE:p*MAX_DATA_SIZE] for p in psc.tolist()], dtype='object')  # Preserve binary data
     })
-    
-    return headerDF
 
+def DF_tmp_data(file_name):
+    
+    '''
+    Decode the temporary data file compiled by encode_data function.
+    input:
+        file_name: str
+            The name of the temporary data file to read.
+    output:
+        headerDF: DataFrame
+            A DataFrame containing the header information extracted from the file.
+    '''
+    
+    Data = load_tmp_data(file_name)
+    if len(Data) == 0:
+        return packets_to_DF(FilePackets(0, 0, 0))
+    return pd.concat([packets_to_DF(packets) for packets in Data], ignore_index=True)
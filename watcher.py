@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import struct
+import select
+import ctypes
+import ctypes.util
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_EVENT = struct.Struct('iIII') # wd, mask, cookie, len
+
+def is_temporary(name):
+    # files being written under a temporary name and renamed when complete
+    return name.startswith('.') or name.endswith(('.part', '.tmp'))
+
+def list_files(folder):
+    # Get the files in a folder, not including folders
+    return {f for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f))}
+
+class InotifyWatcher:
+    '''
+    Report files of the watched folders once they are complete, i.e. closed after writing
+    or renamed into the folder (inotify IN_CLOSE_WRITE / IN_MOVED_TO). Linux only.
+    '''
+
+    def __init__(self, folders):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.folders = {}
+        for folder in folders:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {folder}')
+            self.folders[wd] = folder
+
+    def wait(self, timeout):
+        '''
+        Wait up to timeout seconds for complete files.
+        Output:
+            ready: dict
+                folder -> set of file names.
+        '''
+        ready = {folder: set() for folder in self.folders.values()}
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return ready
+        while True:
+            try:
+                buf = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(buf):
+                wd, mask, cookie, size = IN_EVENT.unpack_from(buf, pos)
+                name = buf[pos + IN_EVENT.size:pos + IN_EVENT.size + size].rstrip(b'\0')
+                pos += IN_EVENT.size + size
+                if mask & IN_Q_OVERFLOW:
+                    # events were lost, rescan every folder
+                    for folder in ready:
+                        ready[folder] |= list_files(folder)
+                elif wd in self.folders and not mask & IN_ISDIR:
+                    ready[self.folders[wd]].add(os.fsdecode(name))
+        # a file may have been moved away or deleted since the event
+        for folder in ready:
+            ready[folder] = {f for f in ready[folder] if not is_temporary(f) and os.path.isfile(os.path.join(folder, f))}
+        return ready
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    '''
+    Fallback when inotify is not available: list the folders every poll interval and report
+    a file once its size and modification time did not change between two polls.
+    '''
+
+    def __init__(self, folders, poll=1.0):
+        self.folders = list(folders)
+        self.poll = poll
+        self.seen = {}     # path -> (size, mtime) at the last poll
+        self.reported = set()
+
+    def wait(self, timeout):
+        ready = {folder: set() for folder in self.folders}
+        deadline = time.monotonic() + timeout
+        while True:
+            current = {}
+            for folder in self.folders:
+                for f in list_files(folder):
+                    if is_temporary(f):
+                        continue
+                    path = os.path.join(folder, f)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    current[path] = (st.st_size, st.st_mtime_ns)
+                    if path not in self.reported and self.seen.get(path) == current[path]:
+                        ready[folder].add(f)
+                        self.reported.add(path)
+            self.seen = current
+            self.reported &= set(current)
+            if any(ready.values()) or time.monotonic() >= deadline:
+                return ready
+            time.sleep(min(self.poll, max(deadline - time.monotonic(), 0)))
+
+    def close(self):
+        pass
+
+def make_watcher(folders, poll=1.0):
+    '''
+    Return an InotifyWatcher, or a PollingWatcher if inotify cannot be used on this system.
+    '''
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(folders)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(folders, poll)